@@ -2,6 +2,8 @@ import maya.cmds as cmds
 import random
 import math
 import sys
+import meshTopology
+from quickCity import cityRandom
 
 """
 STUFF OF NOTE:
@@ -10,10 +12,9 @@ parent plane for buildPlanes needs to be at the origin
 Using Planes: Remember to freeze transforms on the plane you're highlighting faces on
 """
 
-random.seed(256)
-
 class cityBlock:
     name = ""
+    seed = cityRandom.SEED
     centerFace = ""
     parentPlane = ""
     parentMesh = ""
@@ -196,16 +197,21 @@ def extrudeList(face, extrudes, heights, scales):
         else:
             print "e was not a valid extrude type"
     
-def makeBuilding(face, levels, height, sidewalkHeight):
+#returns the random stream for a face of the block, see quickCity.cityRandom
+def faceRandom(block, face):
+    faceIndex = meshTopology.splitComponent(face)[2]
+    return cityRandom.faceRandom(block.seed, block.name, faceIndex)
+
+def makeBuilding(face, levels, height, sidewalkHeight, rand=random):
     hl = height/levels
-    type = random.choice(['indent', 'rim','well'])
+    type = rand.choice(['indent', 'rim','well'])
     makeSidewalk(face, sidewalkHeight)
     for i in range(1, levels):
         dHeight = height/(2*i)
         #extrude in
         extrude1 = cmds.polyExtrudeFacet(face, ch=1, kft=0)[0]
-        cmds.setAttr(extrude1+".localScaleX", 0.5+(0.5*random.random())); 
-        cmds.setAttr(extrude1+".localScaleY", 0.5+(0.5*random.random()));
+        cmds.setAttr(extrude1+".localScaleX", 0.5+(0.5*rand.random())); 
+        cmds.setAttr(extrude1+".localScaleY", 0.5+(0.5*rand.random()));
         #extrude again and translate up
         extrude2 = cmds.polyExtrudeFacet(face, ch=1, kft=0)[0]
         cmds.setAttr(extrude2+".localTranslateZ",  dHeight)
@@ -215,7 +221,7 @@ def makeBuilding(face, levels, height, sidewalkHeight):
             makeRim(face, hl/10.0)
         if type == 'well':
             makeWell(face, hl/30.0)
-        if(i == levels-1 and random.random() > 0.6):
+        if(i == levels-1 and rand.random() > 0.6):
             makeAntenna(face, dHeight/2.0)
 
 #creates buildings on selected faces with probability 1-droprate
@@ -226,11 +232,12 @@ def buildMesh(block):
     i = 0
     for f in faces:
         drop = block.dropRate
-        if(random.random() >= drop):
+        rand = faceRandom(block, f)
+        if(rand.random() >= drop):
             cmds.select(f)
-            height = 1.0*random.choice(block.heightRange)
-            levels = random.choice(block.levelRange)
-            makeBuilding(f,levels, height, sidewalkHeight)
+            height = 1.0*rand.choice(block.heightRange)
+            levels = rand.choice(block.levelRange)
+            makeBuilding(f,levels, height, sidewalkHeight, rand)
         if(not updateProgressWindow(i, len(faces))):
             break
         i += 1
@@ -245,9 +252,10 @@ def buildPlanes(block):
     i = 0
     sidewalkHeight = max(block.heightRange)/160.0
     for f in faces:
-        if(random.random() >= block.dropRate):
-            height = 1.0*random.choice(block.heightRange)
-            levels = random.choice(block.levelRange)
+        rand = faceRandom(block, f)
+        if(rand.random() >= block.dropRate):
+            height = 1.0*rand.choice(block.heightRange)
+            levels = rand.choice(block.levelRange)
             #get the midpoint of the current face
             verts = makeVertList(cmds.xform(f, q=True, t=True))
             midpoint = getMidpoint(verts, True)
@@ -258,7 +266,7 @@ def buildPlanes(block):
             cmds.duplicate(name=dupName)
             cmds.xform(t=midpoint)
             #create building and add it to building list
-            makeBuilding(dupFace, levels, height, sidewalkHeight)
+            makeBuilding(dupFace, levels, height, sidewalkHeight, rand)
             buildings += [dupName]
             i += 1
         if(not updateProgressWindow(i, len(faces))):
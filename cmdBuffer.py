@@ -0,0 +1,429 @@
+__doc__ = """
+A command buffer for maya.cmds. Commands are recorded as they are issued and
+run in bulk on flush, inside a single undo chunk and with viewport refresh
+suspended, rather than paying the undo queue and redraw overhead per call.
+RecordingCmds is a stand-in for maya.cmds that records and counts calls, so
+command sequences can be inspected without Maya, and ProfilingCmds also
+measures the size of each call and adds up a simulated cost for it.
+"""
+
+# Standard Imports
+import unittest
+
+# Non-standard Imports
+import componentSet
+
+# Maya Imports
+MAYA_MODE = True
+try:
+    import maya.cmds as cmds
+except ImportError:
+    MAYA_MODE = False
+    cmds = None
+
+# Globals
+# Commands RecordingCmds treats as creating a node, returning [<name><n>].
+NODE_COMMANDS = ['polyCube', 'polyPlane', 'polyExtrudeFacet', 'polyChipOff',
+                 'polyTriangulate', 'instance', 'shadingNode', 'sets']
+
+# Simulated cost of commands for ProfilingCmds, in seconds, as (per call, per
+# item passed). These are rough weights to compare command streams with, not
+# measurements of any particular Maya; commands not listed cost DEFAULT_COST.
+DEFAULT_COST = (1e-5, 1e-6)
+COMMAND_COSTS = {
+    'polyExtrudeFacet': (1e-3, 5e-5),
+    'duplicate': (5e-4, 1e-5),
+    'instance': (2e-4, 1e-5),
+    'group': (2e-4, 2e-6),
+    'parent': (2e-4, 2e-6),
+    'delete': (2e-4, 1e-5),
+    'sets': (2e-4, 1e-6),
+    'select': (1e-4, 1e-6),
+    'polySelectConstraint': (5e-4, 0.0),
+    'xform': (5e-5, 1e-6),
+    'setAttr': (3e-5, 0.0),
+    'polyInfo': (1e-4, 2e-6),
+    'polyChipOff': (1e-3, 5e-5),
+}
+
+# The number of flushes currently suspending refresh. refresh's suspend flag
+# can't be queried, so only the outermost flush suspends and resumes it.
+_SUSPEND_DEPTH = 0
+
+# Exceptions
+class CommandBufferError(Exception):pass
+
+# Classes
+class CommandBuffer(object):
+    """
+    Records maya.cmds calls made on it and runs them when flushed. Any cmds
+    function can be called on the buffer, e.g. buf.setAttr(...). Each call
+    returns a DeferredResult standing in for the command's return value,
+    which may be indexed or concatenated with strings and passed on to later
+    buffered commands. Query commands need their results immediately, so they
+    should be run directly rather than buffered.
+    """
+    def __init__(self, backend=None, undoable=True, suspendRefresh=True):
+        """
+        @param backend module
+            The module commands are run against, maya.cmds by default.
+        @param undoable bool
+            If True, each flush is wrapped in one undo chunk. If False, undo
+            is turned off while flushing, which is faster but cannot be
+            undone.
+        @param suspendRefresh bool
+            If True, viewport refresh is suspended while flushing.
+        """
+        if backend is None:
+            backend = cmds
+        if backend is None:
+            raise CommandBufferError("No backend supplied outside of Maya")
+        self.backend = backend
+        self.undoable = undoable
+        self.suspendRefresh = suspendRefresh
+        self.commands = []
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def recorder(*args, **kwargs):
+            return self.record(name, args, kwargs)
+        recorder.__name__ = name
+        return recorder
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.flush()
+        else:
+            self.clear()
+
+    def record(self, name, args=(), kwargs=None):
+        """
+        Records a call to the cmds function name with the given positional
+        and keyword arguments. Returns a DeferredResult for its return value.
+        """
+        kwargs = kwargs or {}
+        result = DeferredResult()
+        self.commands.append((name, args, kwargs, result))
+        return result
+
+    def clear(self):
+        """
+        Discards any recorded commands.
+        """
+        self.commands = []
+
+    def flush(self):
+        """
+        Runs the recorded commands in order and clears the buffer. Returns
+        the list of command return values.
+        """
+        commands = self.commands
+        self.commands = []
+        if not commands:
+            return []
+
+        global _SUSPEND_DEPTH
+        backend = self.backend
+        # Undo and refresh are put back as they were, so flushes nested in
+        # code that has already turned them off leave them off.
+        undoWasOn = False
+        if self.undoable:
+            backend.undoInfo(openChunk=True)
+        else:
+            undoWasOn = backend.undoInfo(q=True, stateWithoutFlush=True) is\
+                    not False
+            if undoWasOn:
+                backend.undoInfo(stateWithoutFlush=False)
+        suspending = self.suspendRefresh and not _SUSPEND_DEPTH
+        if self.suspendRefresh:
+            _SUSPEND_DEPTH += 1
+        if suspending:
+            backend.refresh(suspend=True)
+
+        results = []
+        try:
+            for name, args, kwargs, result in commands:
+                args = _resolve(args)
+                kwargs = _resolve(kwargs)
+                result.value = getattr(backend, name)(*args, **kwargs)
+                result.resolved = True
+                results.append(result.value)
+        finally:
+            if self.suspendRefresh:
+                _SUSPEND_DEPTH -= 1
+            if suspending:
+                backend.refresh(suspend=False)
+            if self.undoable:
+                backend.undoInfo(closeChunk=True)
+            elif undoWasOn:
+                backend.undoInfo(stateWithoutFlush=True)
+        return results
+
+
+class DeferredResult(object):
+    """
+    The return value of a buffered command, available as value once the
+    buffer has been flushed. Indexing or adding to a DeferredResult gives
+    another DeferredResult, so results can be used to build the arguments of
+    later buffered commands, e.g. buf.setAttr(extrude[0]+'.localScaleX', s).
+    """
+    def __init__(self, source=None, operation=None, operand=None):
+        """
+        source: the DeferredResult this one is derived from, if any.
+        operation: 'getitem', 'add' or 'radd', applied to the source value.
+        operand: the index or value the operation uses.
+        """
+        self.source = source
+        self.operation = operation
+        self.operand = operand
+        self.resolved = False
+        self.value = None
+
+    def __getitem__(self, key):
+        return DeferredResult(self, 'getitem', key)
+
+    def __add__(self, other):
+        return DeferredResult(self, 'add', other)
+
+    def __radd__(self, other):
+        return DeferredResult(self, 'radd', other)
+
+    def resolve(self):
+        """
+        Returns the value this result stands for. Raises a CommandBufferError
+        if the command producing it has not been flushed.
+        """
+        if self.source is None:
+            if not self.resolved:
+                raise CommandBufferError("Command has not been flushed")
+            return self.value
+        value = self.source.resolve()
+        operand = _resolve(self.operand)
+        if self.operation == 'getitem':
+            return value[operand]
+        if self.operation == 'add':
+            return value + operand
+        return operand + value
+
+
+class RecordingCmds(object):
+    """
+    A stand-in for maya.cmds that records every call made on it. Commands in
+    NODE_COMMANDS return a made up node name, anything else returns None
+    unless a return value is registered for it.
+    """
+    def __init__(self, returnValues=None):
+        """
+        @param returnValues dict
+            Maps command names to a value to return, or to a function called
+            with the command arguments to produce one.
+        """
+        self.returnValues = dict(returnValues or {})
+        self.calls = []
+        self._nodeCounts = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def command(*args, **kwargs):
+            return self.call(name, args, kwargs)
+        command.__name__ = name
+        return command
+
+    def call(self, name, args=(), kwargs=None):
+        """
+        Records a call to the command name with the given positional and 
+        keyword arguments and returns its stand-in result.
+        """
+        kwargs = kwargs or {}
+        self.calls.append((name, args, kwargs))
+        if name in self.returnValues:
+            value = self.returnValues[name]
+            if callable(value):
+                return value(*args, **kwargs)
+            return value
+        if name in ('duplicate', 'instance', 'group') and kwargs.get('name'):
+            if name == 'group':
+                return kwargs['name']
+            return [kwargs['name']]
+        if name in NODE_COMMANDS:
+            count = self._nodeCounts.get(name, 0) + 1
+            self._nodeCounts[name] = count
+            return ['%s%d' % (name, count)]
+        return None
+
+    def counts(self):
+        """
+        Returns a dict of {command name: number of calls}.
+        """
+        counts = {}
+        for name, args, kwargs in self.calls:
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def reset(self):
+        """
+        Forgets all recorded calls.
+        """
+        self.calls = []
+        self._nodeCounts = {}
+
+
+class ProfilingCmds(RecordingCmds):
+    """
+    A RecordingCmds that also records, for every call, the number of items
+    passed to it (components in compact ranges are counted one by one) and a
+    simulated cost from COMMAND_COSTS, so the command streams of different
+    implementations can be compared outside Maya.
+    """
+    def __init__(self, returnValues=None, costs=None):
+        """
+        @param costs dict
+            Overrides COMMAND_COSTS for the given commands.
+        """
+        super(ProfilingCmds, self).__init__(returnValues)
+        self.costs = dict(COMMAND_COSTS)
+        self.costs.update(costs or {})
+        self.sizes = []
+        self.simulated = []
+
+    def call(self, name, args=(), kwargs=None):
+        size = argumentSize(args)
+        perCall, perItem = self.costs.get(name, DEFAULT_COST)
+        self.sizes.append(size)
+        self.simulated.append(perCall + perItem*size)
+        return super(ProfilingCmds, self).call(name, args, kwargs)
+
+    def profile(self):
+        """
+        Returns a dict of {command name: (calls, items, simulated seconds)}.
+        """
+        profile = {}
+        for (name, args, kwargs), size, cost in zip(self.calls, self.sizes,
+                self.simulated):
+            calls, items, seconds = profile.get(name, (0, 0, 0.0))
+            profile[name] = (calls+1, items+size, seconds+cost)
+        return profile
+
+    def simulatedTime(self):
+        """
+        Returns the simulated seconds of every recorded call.
+        """
+        return sum(self.simulated)
+
+    def reset(self):
+        super(ProfilingCmds, self).reset()
+        self.sizes = []
+        self.simulated = []
+
+
+# Functions
+def argumentSize(value):
+    """
+    Returns the number of items in a command argument: the length of lists
+    and tuples, summed over their contents, the number of components in a
+    component name such as 'pPlane1.f[0:9]', and 1 for anything else.
+    """
+    if isinstance(value, (list, tuple)):
+        return sum([argumentSize(v) for v in value])
+    if isinstance(value, componentSet.STRING_TYPES) and value.endswith(']'):
+        try:
+            return len(componentSet.ComponentSet.fromStrings(value))
+        except componentSet.ComponentSetError:
+            pass
+    return 1
+
+def _resolve(value):
+    """
+    Replaces any DeferredResults in value, which may be nested in lists,
+    tuples or dicts, with the values they stand for.
+    """
+    if isinstance(value, DeferredResult):
+        return value.resolve()
+    if isinstance(value, (list, tuple)):
+        return type(value)([_resolve(v) for v in value])
+    if isinstance(value, dict):
+        return dict([(k, _resolve(v)) for k, v in value.items()])
+    return value
+
+
+# Tests
+class TestCommandBuffer(unittest.TestCase):
+    def setUp(self):
+        self.test_cmds = RecordingCmds()
+        self.test_buffer = CommandBuffer(self.test_cmds)
+
+    def test_flush(self):
+        """
+        test_flush -- ensure commands run in order inside one undo chunk with
+        refresh suspended.
+        """
+        self.test_buffer.polyCube(name='box')
+        self.test_buffer.setAttr('box.tx', 1.0)
+        self.assertEqual(self.test_cmds.calls, [])
+        self.test_buffer.flush()
+        names = [name for name, args, kwargs in self.test_cmds.calls]
+        self.assertEqual(names, ['undoInfo', 'refresh', 'polyCube', 'setAttr',
+                                 'refresh', 'undoInfo'])
+        self.assertEqual(len(self.test_buffer), 0)
+
+    def test_nested_flush(self):
+        """
+        test_nested_flush -- ensure a flush inside code that turned undo off
+        or suspended refresh leaves them that way.
+        """
+        offCmds = RecordingCmds({'undoInfo': False,
+            'nested': lambda: inner.flush()})
+        inner = CommandBuffer(offCmds, undoable=False)
+        inner.setAttr('box.ty', 1.0)
+        outer = CommandBuffer(offCmds, undoable=False)
+        outer.nested()
+        outer.flush()
+        calls = [(name, kwargs) for name, args, kwargs in offCmds.calls]
+        self.assertFalse(('undoInfo', {'stateWithoutFlush': True}) in calls)
+        self.assertEqual([c for c in calls if c[0] == 'refresh'],
+                [('refresh', {'suspend': True}), 
+                 ('refresh', {'suspend': False})])
+
+    def test_deferred_result(self):
+        """
+        test_deferred_result -- ensure results of earlier commands can be used
+        in the arguments of later ones.
+        """
+        extrude = self.test_buffer.polyExtrudeFacet('plane.f[0]', ch=1)
+        self.test_buffer.setAttr(extrude[0]+'.localTranslateZ', 2.0)
+        self.test_buffer.flush()
+        self.assertEqual(extrude.resolve(), ['polyExtrudeFacet1'])
+        self.assertEqual(self.test_cmds.calls[3][1],
+                         ('polyExtrudeFacet1.localTranslateZ', 2.0))
+
+    def test_counts(self):
+        """
+        test_counts -- ensure calls are counted per command.
+        """
+        for i in range(3):
+            self.test_buffer.setAttr('box.tx', i)
+        self.test_buffer.flush()
+        self.assertEqual(self.test_cmds.counts()['setAttr'], 3)
+
+    def test_profile(self):
+        """
+        test_profile -- ensure calls are sized by their components and cost
+        per call plus per item.
+        """
+        profiling = ProfilingCmds(costs={'sets': (1.0, 0.5)})
+        profiling.sets(['p.f[0:9]', 'p.f[20]'], e=True, forceElement='aSG')
+        profiling.sets('q', e=True, forceElement='aSG')
+        self.assertEqual(profiling.profile()['sets'], (2, 12, 8.0))
+        self.assertEqual(profiling.simulatedTime(), 8.0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
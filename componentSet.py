@@ -0,0 +1,226 @@
+__doc__ = """
+Sets of mesh components held as integer intervals. Maya gives selections in
+a compact range syntax, e.g. ['pPlane1.vtx[0:99]', 'pPlane1.vtx[120]'];
+rather than flattening these into one string per component, a ComponentSet
+keeps the ranges as sorted inclusive (start, end) intervals. Sets can be
+combined, tested and iterated over as indices without expanding them, and
+give back compact range strings to pass to cmds.
+"""
+
+# Standard Imports
+import array, bisect, re, unittest
+
+# Globals
+COMPONENT_RANGE_RE = re.compile(r"^(.*)\.(\w+)\[(\d+)(?::(\d+))?\]$")
+STRING_TYPES = (str, type(u''))
+
+# Exceptions
+class ComponentSetError(Exception):pass
+
+# Classes
+class ComponentSet(object):
+    """
+    The components of one type ('vtx', 'e', 'f', ...) of one mesh. The set is
+    stored as sorted, non-overlapping, non-adjacent inclusive intervals, in
+    parallel starts and ends arrays. Iterating a set gives its component
+    indices in increasing order.
+    """
+    def __init__(self, mesh, componentType, intervals=()):
+        """
+        @param mesh string
+            The name of the mesh.
+        @param componentType string
+            The component type, as it appears in component names.
+        @param intervals list
+            Inclusive (start, end) index intervals, in any order. They may
+            overlap.
+        """
+        self.mesh = mesh
+        self.componentType = componentType
+        self.starts = array.array('i')
+        self.ends = array.array('i')
+        for start, end in sorted(intervals):
+            if end < start:
+                raise ComponentSetError("Interval %d:%d is empty" % (start,
+                    end))
+            if self.ends and start <= self.ends[-1]+1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @classmethod
+    def fromStrings(cls, components):
+        """
+        Returns the ComponentSet of component names in Maya's range syntax,
+        as cmds.ls returns them. Every component must be of the same type on
+        the same mesh.
+
+        @param components list
+            Component names, e.g. ['pPlane1.f[0:3]', 'pPlane1.f[7]'], or a
+            single name.
+        """
+        if isinstance(components, STRING_TYPES):
+            components = [components]
+        mesh = componentType = None
+        intervals = []
+        for component in components:
+            match = COMPONENT_RANGE_RE.match(component)
+            if not match:
+                raise ComponentSetError("%s is not a component" % component)
+            name, kind, start, end = match.groups()
+            if mesh is None:
+                mesh, componentType = name, kind
+            elif (name, kind) != (mesh, componentType):
+                raise ComponentSetError("%s is not a %s component of %s" %
+                        (component, componentType, mesh))
+            if end is None:
+                end = start
+            intervals.append((int(start), int(end)))
+        if mesh is None:
+            raise ComponentSetError("No components were given")
+        return cls(mesh, componentType, intervals)
+
+    @classmethod
+    def fromIndices(cls, mesh, componentType, indices):
+        """
+        Returns the ComponentSet holding the given component indices.
+        """
+        return cls(mesh, componentType, [(i, i) for i in indices])
+
+    def __len__(self):
+        return sum(self.ends) - sum(self.starts) + len(self.starts)
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            for i in range(start, end+1):
+                yield i
+
+    def __contains__(self, index):
+        i = bisect.bisect_right(self.starts, index) - 1
+        return i >= 0 and index <= self.ends[i]
+
+    def __eq__(self, other):
+        return isinstance(other, ComponentSet) and\
+                self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'ComponentSet(%r)' % self.names()
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def intervals(self):
+        """
+        Returns the set's inclusive (start, end) intervals.
+        """
+        return list(zip(self.starts, self.ends))
+
+    def union(self, other):
+        """
+        Returns the components in either set.
+        """
+        self._checkCompatible(other)
+        return ComponentSet(self.mesh, self.componentType, self.intervals() +
+                other.intervals())
+
+    def intersection(self, other):
+        """
+        Returns the components in both sets.
+        """
+        self._checkCompatible(other)
+        intervals = []
+        i = j = 0
+        while i < len(self.starts) and j < len(other.starts):
+            start = max(self.starts[i], other.starts[j])
+            end = min(self.ends[i], other.ends[j])
+            if start <= end:
+                intervals.append((start, end))
+            if self.ends[i] < other.ends[j]:
+                i += 1
+            else:
+                j += 1
+        return ComponentSet(self.mesh, self.componentType, intervals)
+
+    def names(self):
+        """
+        Returns the set as compact component names in Maya's range syntax,
+        one per interval, ready to pass to cmds.
+        """
+        names = []
+        for start, end in zip(self.starts, self.ends):
+            if start == end:
+                names.append('%s.%s[%d]' % (self.mesh, self.componentType,
+                    start))
+            else:
+                names.append('%s.%s[%d:%d]' % (self.mesh, self.componentType,
+                    start, end))
+        return names
+
+    def flatNames(self):
+        """
+        Returns a name for every component in the set, for the few commands
+        that need single components.
+        """
+        return ['%s.%s[%d]' % (self.mesh, self.componentType, i) for i in
+                self]
+
+    def _key(self):
+        return (self.mesh, self.componentType, self.starts, self.ends)
+
+    def _checkCompatible(self, other):
+        if (self.mesh, self.componentType) != (other.mesh,
+                other.componentType):
+            raise ComponentSetError("Can't combine %s components of %s with"
+                    " %s components of %s" % (self.componentType, self.mesh,
+                    other.componentType, other.mesh))
+
+
+# Tests
+class TestComponentSet(unittest.TestCase):
+    def setUp(self):
+        self.test_set = ComponentSet.fromStrings(['pPlane1.vtx[5:9]',
+            'pPlane1.vtx[0:2]', 'pPlane1.vtx[3]', 'pPlane1.vtx[20]'])
+
+    def test_parse(self):
+        """
+        test_parse -- ensure ranges are parsed, merged when they touch, and
+        written back compactly.
+        """
+        self.assertEqual(self.test_set.intervals(), [(0, 3), (5, 9),
+            (20, 20)])
+        self.assertEqual(len(self.test_set), 10)
+        self.assertEqual(self.test_set.names(), ['pPlane1.vtx[0:3]',
+            'pPlane1.vtx[5:9]', 'pPlane1.vtx[20]'])
+        self.assertEqual(ComponentSet.fromStrings(self.test_set.names()),
+                self.test_set)
+        self.assertTrue(4 not in self.test_set and 9 in self.test_set)
+        self.assertRaises(ComponentSetError, ComponentSet.fromStrings,
+                ['pPlane1.vtx[0]', 'pPlane1.f[0]'])
+        self.assertRaises(ComponentSetError, ComponentSet.fromStrings,
+                ['pPlane1'])
+
+    def test_union_intersection(self):
+        """
+        test_union_intersection -- ensure combined sets match Python sets of
+        their indices.
+        """
+        other = ComponentSet('pPlane1', 'vtx', [(2, 6), (15, 25)])
+        self.assertEqual(list(self.test_set | other),
+                sorted(set(self.test_set) | set(other)))
+        self.assertEqual(list(self.test_set & other),
+                sorted(set(self.test_set) & set(other)))
+        self.assertEqual((self.test_set & other).names(),
+                ['pPlane1.vtx[2:3]', 'pPlane1.vtx[5:6]', 'pPlane1.vtx[20]'])
+        self.assertRaises(ComponentSetError, self.test_set.union,
+                ComponentSet('pPlane2', 'vtx', [(0, 1)]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
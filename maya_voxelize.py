@@ -5,12 +5,17 @@ import math, random
 
 # Non-standard imports
 import maya.cmds as cmds
+import cmdBuffer
+import meshTopology
 
 __doc__ = """
 This is a library for taking a mesh and 'voxelizing' it. It will create cubes 
 at each vertex, giving it a voxel like appearance.
 """
 
+# Globals
+PROGRESS_STEP = 100
+
 # Functions.
 def baseCube(cubeName, avgEdgeLength):
     """
@@ -63,100 +68,138 @@ def squaredDistanceBetween(v1, v2):
 
 def averageEdgeLength(meshName, useRandomSample=True): 
     """
-    Calculate the average edge length of the provided mesh.
-    useRandomSample: If True, takes a random sampling of 10% of the verts,
+    Calculate the average edge length of the provided mesh. This is the root
+    mean square of the edge lengths, which weights long edges a little more
+    than the plain mean.
+    useRandomSample: If True, takes a random sampling of 10% of the edges,
     rather than using all of them, as that would take a while for hi poly models.
     """
-    edges = grabEdges(meshName)                  
-    numEdges = len(edges)
-    n = 1
-    avg = 0
-    if not useRandomSample:
-        print "Sampling %s edges." % numEdges
-        for e in edges:
-            cmds.select(e)
-            cmds.ConvertSelectionToVertices()
-
-            #fl flattens list so you get both verts instead of edge.vtx[0:1]
-            verts = cmds.ls(sl=True, fl=True) 
-            sample = squaredDistanceBetween(verts[0], verts[1])
-            avg = ((n-1)*avg + sample)/n
-            n += 1
+    sampleSize = None
+    if useRandomSample:
+        sampleSize = max(1, int(cmds.polyEvaluate(meshName, e=True)*0.1))
+    stats = edgeLengthStats(meshName, sampleSize=sampleSize)
+    print "Sampled %s edges." % stats['count']
+    return stats['rms']
+
+def edgeLengthStats(meshName, sampleSize=None, percentiles=(5, 50, 95)):
+    """
+    Calculate edge length statistics for the provided mesh. Vertex positions
+    and edge vertex indices are each fetched with a single query, so the cost
+    is one pass over the edges rather than several Maya calls per edge.
+    Returns a dict with the sample count, mean, rms, min, max and a 
+    percentiles dict of {percentile: length}.
+    sampleSize: If given, only this many edges are sampled (without
+    replacement).
+    percentiles: The percentiles to report, from 0 to 100.
+    """
+    positions = grabVertexPositions(meshName)
+    edgeVerts = grabEdgeVertexIndices(meshName)
+    numEdges = len(edgeVerts)/2
+    if sampleSize is not None and sampleSize < numEdges:
+        edgeIds = random.sample(xrange(numEdges), sampleSize)
     else:
-        print "Sampling %s edges." % 0.1*numEdges
-        for i in range(0, int(numEdges*0.1)): 
-            e = random.choice(edges)
-
-            # Sampling without replacement, so remove e
-            edges.remove(e) 
-            cmds.select(e)
-            cmds.ConvertSelectionToVertices()
-            verts = cmds.ls(sl=True, fl=True)
-            sample = squaredDistanceBetween(verts[0], verts[1])
-            avg = ((n-1)*avg + sample)/n
-            n += 1
-    return math.sqrt(avg)
-        
-        
+        edgeIds = xrange(numEdges)
+
+    lengths = []
+    for e in edgeIds:
+        a = 3*edgeVerts[2*e]
+        b = 3*edgeVerts[2*e+1]
+        dx = positions[a]-positions[b]
+        dy = positions[a+1]-positions[b+1]
+        dz = positions[a+2]-positions[b+2]
+        lengths.append(math.sqrt(dx*dx + dy*dy + dz*dz))
+    lengths.sort()
+
+    count = len(lengths)
+    stats = {'count':count, 'mean':0.0, 'rms':0.0, 'min':0.0, 'max':0.0,
+             'percentiles':{}}
+    if not count:
+        return stats
+    stats['mean'] = sum(lengths)/count
+    stats['rms'] = math.sqrt(sum([l*l for l in lengths])/count)
+    stats['min'] = lengths[0]
+    stats['max'] = lengths[-1]
+    for p in percentiles:
+        stats['percentiles'][p] = lengths[int(round(p/100.0*(count-1)))]
+    return stats
+
+def grabVertexPositions(mesh):
+    """
+    Given a mesh, returns a flat [x0, y0, z0, x1, ...] array of the positions 
+    of its vertices.
+    """
+    return meshTopology.getTopology(mesh).positions()
+
+def grabEdgeVertexIndices(mesh):
+    """
+    Given a mesh, returns a flat [a0, b0, a1, b1, ...] array of the vertex 
+    indices at either end of each of its edges.
+    """
+    return meshTopology.getTopology(mesh).edgeVertices()
+
 def grabVertices(mesh):
     """
     Given a mesh, returns a list of the vertices of that mesh.
     """
-    verts = []
-    numVerts = cmds.polyEvaluate(mesh, v=True)
-    for v in range(numVerts):
-        verts += [mesh+".vtx[%s]"%v]
-    return verts
+    return list(meshTopology.getTopology(mesh).componentNames('vtx'))
 
 def grabEdges(mesh):
     """
     Given a mesh, returns a list of the edges of that mesh.
     """
-    edges = []
-    numEdges = cmds.polyEvaluate(mesh, e=True)
-    for e in range(numEdges):
-        edges += [mesh+".e[%s]"%e]
-    return edges
+    return list(meshTopology.getTopology(mesh).componentNames('e'))
 
 def voxelizeMesh(meshName, avgEdgeLength, minecraft=True):
     """
     Given a mesh and the avg edge length of that mesh, generate a set of cubes
     to 'voxelize' that mesh.
     """
-    voxels = []
-    voxelMap = {}
     baseCube(meshName+"base", avgEdgeLength)
-    verts = grabVertices(meshName)
-    vertcount = len(verts)
-    initializeProgressWindow("voxelizing " + meshName, vertcount)
-    print "Vertex Count: %s"%len(verts)
-    i = 0
+    positions = grabVertexPositions(meshName)
+    locations = zip(positions[0::3], positions[1::3], positions[2::3])
+    print "Vertex Count: %s"%len(locations)
 
     # If minecraft style, restrict locations to integer values.
     if minecraft:
-        for v in verts:
-            location = cmds.xform(v, q=True, t=True)
-            location = [int(location[0]), int(location[1]), int(location[2])]
-            key = str(location[0])+","+str(location[1])+","+str(location[2])
-            if not key in voxelMap:
-                instanceName = meshName+"voxel"+str(i)
-                makeInstance(meshName+"base", instanceName, True)
-                cmds.xform(instanceName, t=location)
-                voxels += [instanceName]
-                voxelMap[key] = True
-                i += 1
-                if(not updateProgressWindow(i, vertcount)):
-                    break
-    else:
-        for v in verts:
-            location = cmds.xform(v, q=True, t=True)
-            instanceName = meshName+"voxel"+str(i)
-            makeInstance(meshName+"base",instanceName, True)
-            cmds.xform(instanceName, t=location)
-            voxels += [instanceName]
-            i += 1
-    killProgressWindow()
+        locations = quantizeLocations(locations)
+
+    voxels = placeVoxels(meshName, locations)
     cmds.group(voxels, name=meshName+"voxels")
+
+def quantizeLocations(locations):
+    """
+    Floors each (x,y,z) location to the integer cell containing it and 
+    returns the unique cells, sorted.
+    """
+    floor = math.floor
+    cells = set([(int(floor(x)), int(floor(y)), int(floor(z))) 
+                 for x, y, z in locations])
+    return sorted(cells)
+
+def placeVoxels(meshName, locations):
+    """
+    Places a copy of the mesh's base cube at each location and returns the
+    names of the copies. Commands are buffered, and flushed along with a
+    progress window update every PROGRESS_STEP voxels.
+    """
+    voxels = []
+    baseName = meshName+"base"
+    voxelCount = len(locations)
+    commandBuffer = cmdBuffer.CommandBuffer()
+    initializeProgressWindow("voxelizing " + meshName, voxelCount)
+    for i, location in enumerate(locations):
+        instanceName = meshName+"voxel"+str(i)
+        commandBuffer.duplicate(baseName, name=instanceName, 
+                returnRootsOnly=True)
+        commandBuffer.xform(instanceName, t=location)
+        voxels += [instanceName]
+        if i % PROGRESS_STEP == 0:
+            commandBuffer.flush()
+            if not updateProgressWindow(i, voxelCount):
+                break
+    commandBuffer.flush()
+    killProgressWindow()
+    return voxels
         
 def voxelizeObjFile(objectFile, groupName, intFlag, scaleFactor):
     """
@@ -216,15 +259,17 @@ def runMaya(minecraft=False):
     except IndexError:
         print "No mesh selected."
         return
+    meshTopology.invalidate(selectedMesh)
 
     # Determine whether or not to use a random sample.
-    numVerts = grabVertices(selectedMesh)
+    numVerts = cmds.polyEvaluate(selectedMesh, v=True)
     randomSample = numVerts > 10000
     avLen = averageEdgeLength(selectedMesh, useRandomSample=randomSample)
 
     # Scale the mesh down if minecraft style.
     if minecraft:
         scaleToEdgeLength(selectedMesh, avLen)
+        meshTopology.invalidate(selectedMesh)
 
     # Voxelize!
     voxelizeMesh(selectedMesh, avLen, minecraft=minecraft)
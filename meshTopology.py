@@ -0,0 +1,243 @@
+__doc__ = """
+A per-mesh cache of vertex positions, edge vertex pairs and face vertex
+indices. Each is fetched from Maya with a single query the first time it is
+asked for and served from flat arrays after that, so tools chaining several
+mesh helpers only pay for the extraction once. The cache lives for the whole
+session and can't see vertices or transforms move, or a mesh deleted and
+made again under the same name, so tools call invalidate() when they start
+and after editing a mesh. Topology changes that alter the vertex or face
+count are also picked up automatically.
+"""
+
+# Standard Imports
+import array, re, unittest
+
+# Non-standard Imports
+import cmdBuffer
+
+# Maya Imports
+MAYA_MODE = True
+try:
+    import maya.cmds as cmds
+except ImportError:
+    MAYA_MODE = False
+
+# Globals
+COMPONENT_RE = re.compile(r"^(.*)\.(\w+)\[(\d+)\]$")
+_CACHE = {}
+_GENERATIONS = {}
+
+# Classes
+class MeshTopology(object):
+    """
+    The cached topology of a single mesh. Positions are flat
+    [x0, y0, z0, x1, ...] arrays, edges are flat [a0, b0, a1, b1, ...] vertex
+    index arrays, and face vertices are a flat array of vertex indices with
+    faceOffsets marking where each face starts.
+    """
+    def __init__(self, mesh, key):
+        """
+        @param mesh string
+            The name of the mesh.
+        @param key tuple
+            The (generation, vertex count, face count) this topology was
+            fetched at.
+        """
+        self.mesh = mesh
+        self.key = key
+        self._positions = {}
+        self._edgeVertices = None
+        self._faceVertices = None
+        self._faceOffsets = None
+        self._names = {}
+
+    @property
+    def vertexCount(self):
+        return self.key[1]
+
+    @property
+    def faceCount(self):
+        return self.key[2]
+
+    def positions(self, worldSpace=False):
+        """
+        Returns the flat array of vertex positions, in object space unless
+        worldSpace is True.
+        """
+        if worldSpace not in self._positions:
+            self._positions[worldSpace] = array.array('d', cmds.xform(
+                self.mesh+'.vtx[*]', q=True, t=True, ws=worldSpace))
+        return self._positions[worldSpace]
+
+    def edgeVertices(self):
+        """
+        Returns the flat array of the vertex indices at either end of each
+        edge.
+        """
+        if self._edgeVertices is None:
+            edgeVertices = array.array('i')
+            for line in cmds.polyInfo(self.mesh, edgeToVertex=True):
+                # Lines look like 'EDGE      0:      0      1  Hard'
+                values = line.split(':')[1].split()
+                edgeVertices.extend([int(values[0]), int(values[1])])
+            self._edgeVertices = edgeVertices
+        return self._edgeVertices
+
+    def faceVertices(self):
+        """
+        Returns (faceVertices, faceOffsets). The vertex indices of face f are
+        faceVertices[faceOffsets[f]:faceOffsets[f+1]].
+        """
+        if self._faceVertices is None:
+            faceVertices = array.array('i')
+            faceOffsets = array.array('i', [0])
+            for line in cmds.polyInfo(self.mesh, faceToVertex=True):
+                # Lines look like 'FACE      0:      0      1      3      2'
+                values = line.split(':')[1].split()
+                faceVertices.extend([int(v) for v in values])
+                faceOffsets.append(len(faceVertices))
+            self._faceVertices = faceVertices
+            self._faceOffsets = faceOffsets
+        return self._faceVertices, self._faceOffsets
+
+    def faceVertexIndices(self, face):
+        """
+        Returns the vertex indices of the face with the given index.
+        """
+        faceVertices, faceOffsets = self.faceVertices()
+        return faceVertices[faceOffsets[face]:faceOffsets[face+1]]
+
+    def facePositions(self, face, worldSpace=False):
+        """
+        Returns a flat [x0, y0, z0, x1, ...] list of the positions of the
+        vertices of the face with the given index, as cmds.xform would for
+        the face component.
+        """
+        positions = self.positions(worldSpace)
+        facePositions = []
+        for v in self.faceVertexIndices(face):
+            facePositions.extend(positions[3*v:3*v+3])
+        return facePositions
+
+    def componentNames(self, componentType):
+        """
+        Returns the list of component names for every 'vtx', 'e' or 'f'
+        component of the mesh, e.g. ['pPlane1.vtx[0]', 'pPlane1.vtx[1]', ...].
+        """
+        if componentType not in self._names:
+            if componentType == 'vtx':
+                count = self.vertexCount
+            elif componentType == 'f':
+                count = self.faceCount
+            else:
+                count = len(self.edgeVertices())//2
+            self._names[componentType] = ['%s.%s[%d]' % (self.mesh,
+                componentType, i) for i in range(count)]
+        return self._names[componentType]
+
+
+# Functions
+def getTopology(mesh):
+    """
+    Returns the MeshTopology for mesh, reusing the cached one unless the mesh
+    has been invalidated or its vertex or face count has changed.
+    """
+    key = (_GENERATIONS.get(mesh, 0), cmds.polyEvaluate(mesh, v=True),
+           cmds.polyEvaluate(mesh, f=True))
+    topology = _CACHE.get(mesh)
+    if topology is None or topology.key != key:
+        topology = MeshTopology(mesh, key)
+        _CACHE[mesh] = topology
+    return topology
+
+def invalidate(mesh=None):
+    """
+    Marks the cached topology of mesh as out of date, or of every mesh if no
+    mesh is given.
+    """
+    meshes = [mesh]
+    if mesh is None:
+        meshes = list(_CACHE)
+    for m in meshes:
+        _GENERATIONS[m] = _GENERATIONS.get(m, 0) + 1
+        _CACHE.pop(m, None)
+
+def splitComponent(component):
+    """
+    Splits a component name such as 'pPlane1.f[12]' into its mesh name,
+    component type and index, e.g. ('pPlane1', 'f', 12).
+    """
+    match = COMPONENT_RE.match(component)
+    if not match:
+        raise ValueError("%s is not a single component" % component)
+    mesh, componentType, index = match.groups()
+    return mesh, componentType, int(index)
+
+
+# Tests
+class TestMeshTopology(unittest.TestCase):
+    def setUp(self):
+        global cmds
+        self.saved_cmds = globals().get('cmds')
+        self.counts = {'v': 4, 'f': 1}
+        self.test_cmds = cmdBuffer.RecordingCmds({
+            'polyEvaluate': lambda mesh, v=False, f=False: 
+                self.counts['v' if v else 'f'],
+            'polyInfo': lambda mesh, edgeToVertex=False, faceToVertex=False:
+                ['FACE      0:      0      1      3      2\n'] if 
+                faceToVertex else ['EDGE      0:      0      1  Hard\n', 
+                'EDGE      1:      0      2  Hard\n'],
+            'xform': [0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 1.0, 1.0,
+                0.0]})
+        cmds = self.test_cmds
+        invalidate()
+
+    def tearDown(self):
+        global cmds
+        invalidate()
+        if self.saved_cmds is None:
+            del cmds
+        else:
+            cmds = self.saved_cmds
+
+    def test_parse(self):
+        """
+        test_parse -- ensure polyInfo lines and positions are read into flat
+        arrays.
+        """
+        topology = getTopology('pPlane1')
+        self.assertEqual(list(topology.edgeVertices()), [0, 1, 0, 2])
+        self.assertEqual(list(topology.faceVertexIndices(0)), [0, 1, 3, 2])
+        self.assertEqual(topology.facePositions(0)[3:6], [1.0, 0.0, 0.0])
+        self.assertEqual(topology.componentNames('e'), ['pPlane1.e[0]',
+            'pPlane1.e[1]'])
+        self.assertEqual(splitComponent('pPlane1.f[12]'), ('pPlane1', 'f',
+            12))
+        self.assertRaises(ValueError, splitComponent, 'pPlane1.f[0:3]')
+
+    def test_invalidate(self):
+        """
+        test_invalidate -- ensure a cached topology is reused until it is
+        invalidated or its counts change, and is fetched again after.
+        """
+        topology = getTopology('pPlane1')
+        topology.positions()
+        topology.positions()
+        self.assertTrue(getTopology('pPlane1') is topology)
+        self.assertEqual(self.test_cmds.counts()['xform'], 1)
+
+        invalidate('pPlane1')
+        topology = getTopology('pPlane1')
+        topology.positions()
+        self.assertEqual(self.test_cmds.counts()['xform'], 2)
+        invalidate()
+        self.assertFalse(getTopology('pPlane1') is topology)
+
+        topology = getTopology('pPlane1')
+        self.counts['f'] = 2
+        self.assertFalse(getTopology('pPlane1') is topology)
+        self.assertEqual(getTopology('pPlane1').faceCount, 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
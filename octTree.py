@@ -2,20 +2,378 @@ __doc__ = """
 This library is an implementation of an oct tree data structure. 
 """
 
-class OctTree(object):
+# Standard Imports
+import array, heapq, math, mmap, multiprocessing, os, struct, sys, unittest
+from timeit import default_timer
+
+# Globals
+MAX_DIVISION = 16
+INFINITY = float('inf')
+
+# Binary file layout: a header, then one (first_child, point_start,
+# point_count) record per node in breadth first order, then the leaf points as
+# x,y,z doubles. The 8 children of a node are stored contiguously, starting at
+# first_child (-1 for leaves). Everything is little endian.
+FILE_MAGIC = b'OCT1'
+HEADER_STRUCT = struct.Struct('<4sHiII6d')
+NODE_STRUCT = struct.Struct('<iii')
+POINT_STRUCT = struct.Struct('<ddd')
+
+# Exceptions
+class OctTreeError(Exception):pass
+
+# Decorators
+def timed(name):
+    """
+    Records the call count and total seconds spent in the decorated method
+    under name in the instance's timings dict, for reporting by stats().
+    """
+    def decorator(method):
+        def wrapper(self, *args, **kwargs):
+            start = default_timer()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                timing = self.timings.setdefault(name, [0, 0.0])
+                timing[0] += 1
+                timing[1] += default_timer() - start
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+    return decorator
+
+# Classes
+class OctTreeQueries(object):
+    """
+    Read only queries shared by OctTree and MappedOctTree. Subclasses provide
+    a root node, a timings dict and an estimated_bytes() method.
+    """
+    @timed('leaf_containing')
+    def leaf_containing(self, point):
+        """
+        Returns the leaf node containing the given point.
+        point: (x,y,z)
+        """
+        node = self.root
+        while node.children:
+            node = node.child_containing(point)
+        return node
+
+    def ray_leaves(self, origin, direction, occupied_only=True):
+        """
+        Yields (t, leaf) for each leaf the ray passes through, in front to 
+        back order. t is the ray parameter at which the ray enters the leaf.
+        Only the octants the ray actually crosses are visited.
+        origin: (x,y,z) start of the ray.
+        direction: (x,y,z) direction of the ray, need not be normalized.
+        occupied_only: if True, leaves that hold no points are skipped.
+        """
+        return _ray_leaves(self.root, origin, direction, occupied_only)
+
+    @timed('ray_pick')
+    def ray_pick(self, origin, direction):
+        """
+        Returns the first occupied leaf hit by the ray, or None if the ray
+        misses every occupied leaf.
+        """
+        for t, leaf in self.ray_leaves(origin, direction):
+            return leaf
+        return None
+
+    @timed('nearest')
+    def nearest(self, point, max_distance=INFINITY):
+        """
+        Returns (distance, nearest_point) for the stored point nearest to 
+        point, or (INFINITY, None) if no point lies within max_distance.
+        Nodes are visited closest first and any node further away than the
+        best point found so far is skipped.
+        point: (x,y,z)
+        max_distance: the largest distance to search out to.
+        """
+        best_d2 = max_distance*max_distance
+        best = None
+        # The counter keeps nodes at equal distances from being compared.
+        heap = [(_box_distance2(self.root.bp_min, self.root.bp_max, point), 
+                 0, self.root)]
+        pushed = 1
+        while heap:
+            d2, order, node = heapq.heappop(heap)
+            if d2 > best_d2:
+                break
+            children = node.children
+            if children:
+                for child in children:
+                    child_d2 = _box_distance2(child.bp_min, child.bp_max, 
+                            point)
+                    if child_d2 <= best_d2:
+                        heapq.heappush(heap, (child_d2, pushed, child))
+                        pushed += 1
+                continue
+            for p in node.points:
+                dx = p[0]-point[0]; dy = p[1]-point[1]; dz = p[2]-point[2]
+                p_d2 = dx*dx + dy*dy + dz*dz
+                if p_d2 <= best_d2:
+                    best_d2 = p_d2
+                    best = p
+        if best is None:
+            return INFINITY, None
+        return math.sqrt(best_d2), best
+
+    def points_within(self, point, radius):
+        """
+        Yields (distance, stored_point) for every stored point within radius
+        of point, skipping nodes whose bounds are further away than radius.
+        point: (x,y,z)
+        radius: the search radius.
+        """
+        r2 = radius*radius
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if _box_distance2(node.bp_min, node.bp_max, point) > r2:
+                continue
+            children = node.children
+            if children:
+                stack.extend(children)
+                continue
+            for p in node.points:
+                dx = p[0]-point[0]; dy = p[1]-point[1]; dz = p[2]-point[2]
+                p_d2 = dx*dx + dy*dy + dz*dz
+                if p_d2 <= r2:
+                    yield math.sqrt(p_d2), p
+
+    def stats(self):
+        """
+        Returns a dict describing the shape and cost of the tree:
+        node_count, leaf_count, point_count, max_depth, nodes_per_depth 
+        ({depth: node count}), leaf_occupancy ({points in leaf: leaf count}),
+        estimated_bytes and timings ({name: {'calls': n, 'seconds': s}}).
+        """
+        nodes_per_depth = {}
+        leaf_occupancy = {}
+        node_count = 0
+        point_count = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node_count += 1
+            depth = node.division_level
+            nodes_per_depth[depth] = nodes_per_depth.get(depth, 0) + 1
+            children = node.children
+            if children:
+                stack.extend(children)
+            else:
+                occupancy = len(node.points)
+                point_count += occupancy
+                leaf_occupancy[occupancy] =\
+                        leaf_occupancy.get(occupancy, 0) + 1
+
+        timings = {}
+        for name, (calls, seconds) in self.timings.items():
+            timings[name] = {'calls':calls, 'seconds':seconds}
+        return {'node_count':node_count,
+                'leaf_count':sum(leaf_occupancy.values()),
+                'point_count':point_count,
+                'max_depth':max(nodes_per_depth),
+                'nodes_per_depth':nodes_per_depth,
+                'leaf_occupancy':leaf_occupancy,
+                'estimated_bytes':self.estimated_bytes(),
+                'timings':timings}
+
+
+class OctTree(OctTreeQueries):
     """
     A data structure for partitioning space into octants.
     """
-    def __init__(self, bounding_point_min, bounding_point_max):
+    def __init__(self, bounding_point_min, bounding_point_max,
+            max_division=MAX_DIVISION, leaf_capacity=None):
         """
         bounding_point_min: a tuple containing the minimum x,y,z values of the
             initial bounding box.
         bounding_point_max: a tuple containing the maximum x,y,z values of the
             initial bounding box.
+        max_division: the deepest division level insert() will subdivide to.
+        leaf_capacity: the number of points a leaf may hold before insert()
+            subdivides it. None disables automatic subdivision, 0 subdivides
+            every occupied leaf down to max_division.
         """
         self.bp_max = bounding_point_max
         self.bp_min = bounding_point_min
+        self.max_division = max_division
+        self.leaf_capacity = leaf_capacity
         self.root = OctTreeNode(self.bp_min, self.bp_max, dl=0, parent=self)
+        self.timings = {}
+
+    def insert(self, point):
+        """
+        Adds a point to the leaf containing it, subdividing the leaf if it
+        now holds more than leaf_capacity points. Returns the leaf the point
+        ended up in.
+        point: (x,y,z)
+        """
+        node = self.root
+        while node.children:
+            node = node.child_containing(point)
+        node.points.append(point)
+        while self._should_subdivide(node):
+            node.subdivide()
+            for p in node.points:
+                node.child_containing(p).points.append(p)
+            node.points = []
+
+            # Only the child holding the new point can be over capacity.
+            node = node.child_containing(point)
+        return node
+
+    @timed('build')
+    def insert_points(self, points):
+        """
+        Inserts each of the given points.
+        points: an iterable of (x,y,z) tuples.
+        """
+        for point in points:
+            self.insert(point)
+
+    def _should_subdivide(self, node):
+        """
+        Returns True if node holds too many points and may still be divided.
+        """
+        if self.leaf_capacity is None:
+            return False
+        if node.division_level >= self.max_division:
+            return False
+        return len(node.points) > self.leaf_capacity
+
+    def estimated_bytes(self):
+        """
+        Returns an estimate of the memory used by the nodes, their bounds and
+        their points in bytes. Bounds tuples shared between nodes are 
+        counted once per node, so this errs on the high side.
+        """
+        total = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            total += sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+            total += sys.getsizeof(node.bp_min) + sys.getsizeof(node.bp_max)
+            total += sys.getsizeof(node.half_values)
+            total += sys.getsizeof(node.children)
+            total += sys.getsizeof(node.points)
+            for point in node.points:
+                total += sys.getsizeof(point)
+            stack.extend(node.children)
+        return total
+
+    def leaf_indices(self, points, division_level):
+        """
+        Quantizes points to the leaves of a tree uniformly subdivided to 
+        division_level, without building it. Returns the set of unique 
+        (i,j,k) leaf indices, counted in leaves from bp_min along each axis.
+        Points outside the bounds are clamped to the border leaves.
+        points: an iterable of (x,y,z) tuples.
+        """
+        cells = 2**division_level
+        last = cells-1
+        min_x, min_y, min_z = self.bp_min
+        scale_x, scale_y, scale_z = [_cell_scale(lo, hi, cells) for lo, hi in
+                zip(self.bp_min, self.bp_max)]
+        indices = set()
+        for x, y, z in points:
+            i = min(max(int((x-min_x)*scale_x), 0), last)
+            j = min(max(int((y-min_y)*scale_y), 0), last)
+            k = min(max(int((z-min_z)*scale_z), 0), last)
+            indices.add((i, j, k))
+        return indices
+
+    def leaf_center(self, index, division_level):
+        """
+        Returns the center of the leaf with the given (i,j,k) index in a tree
+        uniformly subdivided to division_level. This is the half_values of
+        that leaf.
+        """
+        cells = float(2**division_level)
+        return tuple([lo + (hi-lo)*(i+0.5)/cells for lo, hi, i in 
+            zip(self.bp_min, self.bp_max, index)])
+
+    @timed('build')
+    def insert_points_parallel(self, points, processes=None, split_level=1):
+        """
+        Inserts the given points into an empty tree, building the subtrees 
+        below split_level in separate processes. The resulting tree is the 
+        same as the one insert_points() would build.
+        points: a sequence of (x,y,z) tuples.
+        processes: the number of worker processes, defaults to the number of
+            cpus.
+        split_level: the division level at which work is handed out. Each 
+            level multiplies the number of jobs by 8, which evens out
+            unbalanced point sets at the cost of more serial partitioning.
+        NOTE: on Windows worker processes re-import the calling module, so 
+        this must be called from code guarded by __name__ == '__main__'.
+        """
+        if self.root.children or self.root.points:
+            raise OctTreeError("Parallel inserts require an empty tree")
+
+        # Subdivide the top of the tree here, collecting the nodes at 
+        # split_level that still need building along with their points.
+        jobs = []
+        partitions = [(self.root, list(points))]
+        while partitions:
+            node, node_points = partitions.pop()
+            node.points = node_points
+            if not self._should_subdivide(node):
+                continue
+            if node.division_level >= split_level:
+                node.points = []
+                jobs.append((node, node_points))
+                continue
+            node.subdivide()
+            node.points = []
+            buckets = [[] for child in node.children]
+            half_x, half_y, half_z = node.half_values
+            for p in node_points:
+                child_index = 4*int(p[2] >= half_z) + 2*int(p[1] >= half_y) +\
+                        int(p[0] >= half_x)
+                buckets[child_index].append(p)
+            partitions.extend(zip(node.children, buckets))
+        if not jobs:
+            return
+
+        job_args = [(node.bp_min, node.bp_max, 
+                     self.max_division-node.division_level, 
+                     self.leaf_capacity, node_points) 
+                    for node, node_points in jobs]
+        pool = multiprocessing.Pool(processes)
+        try:
+            subtrees = pool.map(_build_subtree, job_args)
+        finally:
+            pool.close()
+            pool.join()
+
+        # Stitch the subtrees in under their nodes.
+        for (node, node_points), (nodes, points) in zip(jobs, subtrees):
+            _inflate_nodes(node, nodes, points)
+
+    def save(self, file_path):
+        """
+        Writes the tree to file_path in the compact binary format read by
+        load().
+        """
+        nodes, points = _flatten_nodes(self.root)
+        if sys.byteorder == 'big':
+            nodes.byteswap()
+            points.byteswap()
+
+        leaf_capacity = self.leaf_capacity
+        if leaf_capacity is None:
+            leaf_capacity = -1
+        header = HEADER_STRUCT.pack(FILE_MAGIC, self.max_division,
+                leaf_capacity, len(nodes)//3, len(points)//3,
+                *(tuple(self.bp_min)+tuple(self.bp_max)))
+        with open(file_path, 'wb') as f:
+            f.write(header)
+            nodes.tofile(f)
+            points.tofile(f)
+
 
 class OctTreeNode(object):
     """
@@ -37,6 +395,7 @@ class OctTreeNode(object):
         self.parent = parent
         self.division_level = dl
         self.children = []
+        self.points = []
 
     def _half_values(self):
         """
@@ -76,7 +435,7 @@ class OctTreeNode(object):
         in_x = self.bp_min[0] <= x < self.bp_max[0]
         in_y = self.bp_min[1] <= y < self.bp_max[1]
         in_z = self.bp_min[2] <= z < self.bp_max[2]
-        return all(in_x, in_y, in_z)
+        return all([in_x, in_y, in_z])
 
     def subdivide(self):
         """
@@ -125,3 +484,414 @@ class OctTreeNode(object):
 
         # Remove the original node and add the octants
         self.children = octant_list
+
+
+class MappedOctTree(OctTreeQueries):
+    """
+    A read only OctTree backed by a memory mapped file written by 
+    OctTree.save(). Nodes are decoded from the mapping as queries reach them,
+    so opening a tree costs the same regardless of its size, and processes
+    mapping the same file share its pages.
+    """
+    def __init__(self, file_path):
+        """
+        file_path: the path of a file written by OctTree.save().
+        """
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER_STRUCT.size:
+            raise OctTreeError("%s is not an OctTree file" % file_path)
+        header = HEADER_STRUCT.unpack_from(self._map, 0)
+        if header[0] != FILE_MAGIC:
+            raise OctTreeError("%s is not an OctTree file" % file_path)
+        self.max_division = header[1]
+        self.leaf_capacity = header[2]
+        if self.leaf_capacity < 0:
+            self.leaf_capacity = None
+        self.node_count = header[3]
+        self.point_count = header[4]
+        self.bp_min = header[5:8]
+        self.bp_max = header[8:11]
+        self.timings = {}
+        self._node_offset = HEADER_STRUCT.size
+        self._point_offset = self._node_offset +\
+                self.node_count*NODE_STRUCT.size
+        self.root = MappedOctTreeNode(self, 0, self.bp_min, self.bp_max)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Releases the memory mapping.
+        """
+        self._map.close()
+
+    def estimated_bytes(self):
+        """
+        Returns the size of the mapped file in bytes. Only the pages queries
+        touch are actually resident.
+        """
+        return len(self._map)
+
+    def _node_record(self, index):
+        """
+        Returns the (first_child, point_start, point_count) record of a node.
+        """
+        return NODE_STRUCT.unpack_from(self._map, 
+                self._node_offset + index*NODE_STRUCT.size)
+
+    def _points(self, start, count):
+        """
+        Returns count points starting at point index start.
+        """
+        offset = self._point_offset + start*POINT_STRUCT.size
+        return [POINT_STRUCT.unpack_from(self._map, 
+            offset + i*POINT_STRUCT.size) for i in range(count)]
+
+
+class MappedOctTreeNode(OctTreeNode):
+    """
+    A view of a single node in a MappedOctTree. Offers the read only parts of
+    the OctTreeNode interface.
+    """
+    def __init__(self, tree, index, bp_min, bp_max, dl=0):
+        """
+        tree: the MappedOctTree this node belongs to.
+        index: the index of this node's record in the file.
+        bp_min, bp_max: the bounds of this node.
+        dl: the divison level of this node.
+        """
+        self.tree = tree
+        self.index = index
+        self.bp_min = bp_min
+        self.bp_max = bp_max
+        self.division_level = dl
+        self.half_values = self._half_values()
+        self._first_child, self._point_start, self._point_count =\
+                tree._node_record(index)
+
+    @property
+    def children(self):
+        """
+        The 8 child nodes, or an empty list for leaves.
+        """
+        if self._first_child < 0:
+            return []
+        return [self._child(i) for i in range(8)]
+
+    @property
+    def points(self):
+        """
+        The points stored in this node.
+        """
+        return self.tree._points(self._point_start, self._point_count)
+
+    def _child(self, child_index):
+        """
+        Returns the child node for the given octant index.
+        """
+        bp_min, bp_max = _octant_bounds(self.bp_min, self.bp_max,
+                self.half_values, child_index)
+        return MappedOctTreeNode(self.tree, self._first_child+child_index,
+                bp_min, bp_max, dl=self.division_level+1)
+
+    def child_containing(self, point):
+        """
+        Returns the child node containing the given point.
+        point: (x,y,z)
+        """
+        px,py,pz = point
+        half_x, half_y, half_z = self.half_values
+        child_index = 4*int(pz >= half_z) + 2*int(py >= half_y) +\
+                int(px >= half_x)
+        return self._child(child_index)
+
+
+# Functions
+def load(file_path):
+    """
+    Memory maps an OctTree written by OctTree.save(). Returns a 
+    MappedOctTree.
+    """
+    return MappedOctTree(file_path)
+
+def _cell_scale(lo, hi, cells):
+    """
+    Returns the factor converting a distance along an axis spanning lo to hi
+    into a number of cells. Flat axes map everything to the first cell.
+    """
+    if hi <= lo:
+        return 0.0
+    return cells/float(hi-lo)
+
+def _flatten_nodes(root):
+    """
+    Flattens the tree below root into breadth first node records and leaf
+    points, as laid out in the binary file format. Returns a pair of arrays:
+    (first_child, point_start, point_count) ints and x,y,z doubles.
+    """
+    nodes = array.array('i')
+    points = array.array('d')
+    queue = [root]
+    node_count = 1
+    for node in queue:
+        if node.children:
+            nodes.extend([node_count, 0, 0])
+            queue.extend(node.children)
+            node_count += len(node.children)
+        else:
+            nodes.extend([-1, len(points)//3, len(node.points)])
+            for point in node.points:
+                points.extend(point)
+    return nodes, points
+
+def _inflate_nodes(root, nodes, points):
+    """
+    The inverse of _flatten_nodes, rebuilds the flattened tree below root.
+    """
+    queue = [(root, 0)]
+    for node, index in queue:
+        first_child, point_start, point_count = nodes[3*index:3*index+3]
+        if first_child >= 0:
+            node.subdivide()
+            for i, child in enumerate(node.children):
+                queue.append((child, first_child+i))
+        else:
+            node.points = [tuple(points[3*i:3*i+3]) for i in 
+                    range(point_start, point_start+point_count)]
+
+def _build_subtree(args):
+    """
+    Worker for OctTree.insert_points_parallel. Builds a subtree over the given
+    bounds and returns it flattened.
+    """
+    bp_min, bp_max, max_division, leaf_capacity, points = args
+    subtree = OctTree(bp_min, bp_max, max_division=max_division, 
+            leaf_capacity=leaf_capacity)
+    subtree.insert_points(points)
+    return _flatten_nodes(subtree.root)
+
+def _octant_bounds(bp_min, bp_max, half_values, child_index):
+    """
+    Returns the (bp_min, bp_max) of the octant with the given child index, 
+    matching the layout produced by OctTreeNode.subdivide().
+    """
+    oct_min = []
+    oct_max = []
+    for axis in range(3):
+        if child_index & (1 << axis):
+            oct_min.append(half_values[axis])
+            oct_max.append(bp_max[axis])
+        else:
+            oct_min.append(bp_min[axis])
+            oct_max.append(half_values[axis])
+    return tuple(oct_min), tuple(oct_max)
+
+def _box_distance2(bp_min, bp_max, point):
+    """
+    Returns the squared distance from point to the nearest point of an axis
+    aligned box, 0 if point is inside it.
+    """
+    x, y, z = point[0], point[1], point[2]
+    dx = bp_min[0]-x if x < bp_min[0] else (x-bp_max[0] if x > bp_max[0]
+            else 0.0)
+    dy = bp_min[1]-y if y < bp_min[1] else (y-bp_max[1] if y > bp_max[1]
+            else 0.0)
+    dz = bp_min[2]-z if z < bp_min[2] else (z-bp_max[2] if z > bp_max[2]
+            else 0.0)
+    return dx*dx + dy*dy + dz*dz
+
+def _ray_box(bp_min, bp_max, origin, direction):
+    """
+    Slab test of a ray against an axis aligned box. Returns the (t_near, t_far)
+    range of the ray parameter inside the box, or None if the ray misses it.
+    Only the part of the ray in front of the origin (t >= 0) is considered.
+    """
+    t_near = 0.0
+    t_far = INFINITY
+    for axis in range(3):
+        o = origin[axis]
+        d = direction[axis]
+        lo = bp_min[axis]
+        hi = bp_max[axis]
+        if d == 0.0:
+            # Parallel to this slab, so either always or never inside it.
+            if o < lo or o > hi:
+                return None
+            continue
+        t0 = (lo-o)/d
+        t1 = (hi-o)/d
+        if t0 > t1:
+            t0, t1 = t1, t0
+        if t0 > t_near:
+            t_near = t0
+        if t1 < t_far:
+            t_far = t1
+        if t_near > t_far:
+            return None
+    return (t_near, t_far)
+
+def _ray_leaves(root, origin, direction, occupied_only=True):
+    """
+    Generator for OctTree.ray_leaves. Walks the tree with a stack, pushing the
+    children a ray hits in reverse order of entry so they pop front to back.
+    """
+    direction = [float(d) for d in direction]
+    hit = _ray_box(root.bp_min, root.bp_max, origin, direction)
+    if hit is None:
+        return
+    stack = [(hit[0], root)]
+    while stack:
+        t, node = stack.pop()
+        if not node.children:
+            if node.points or not occupied_only:
+                yield t, node
+            continue
+
+        hits = []
+        for child in node.children:
+            child_hit = _ray_box(child.bp_min, child.bp_max, origin, 
+                    direction)
+            if child_hit is not None:
+                hits.append((child_hit[0], child))
+        hits.sort(key=lambda h: h[0], reverse=True)
+        stack.extend(hits)
+
+
+# Tests
+class TestOctTree(unittest.TestCase):
+    def setUp(self):
+        self.test_tree = OctTree((0.0, 0.0, 0.0), (8.0, 8.0, 8.0),
+                max_division=3, leaf_capacity=0)
+        self.test_points = [(0.5, 0.5, 0.5), (4.5, 0.5, 0.5), 
+                            (7.5, 0.5, 0.5), (0.5, 7.5, 7.5)]
+        self.test_tree.insert_points(self.test_points)
+
+    def test_insert(self):
+        """
+        test_insert -- ensure points are pushed down to max_division leaves.
+        """
+        for point in self.test_points:
+            leaf = self.test_tree.leaf_containing(point)
+            self.assertEqual(leaf.division_level, 3)
+            self.assertEqual(leaf.points, [point])
+
+    def test_ray_pick(self):
+        """
+        test_ray_pick -- ensure the nearest occupied leaf is returned.
+        """
+        leaf = self.test_tree.ray_pick((-1.0, 0.5, 0.5), (1.0, 0.0, 0.0))
+        self.assertEqual(leaf.points, [(0.5, 0.5, 0.5)])
+        leaf = self.test_tree.ray_pick((9.0, 0.5, 0.5), (-1.0, 0.0, 0.0))
+        self.assertEqual(leaf.points, [(7.5, 0.5, 0.5)])
+        self.assertEqual(
+                self.test_tree.ray_pick((-1.0, 2.5, 0.5), (1.0, 0.0, 0.0)),
+                None)
+
+    def test_ray_leaves(self):
+        """
+        test_ray_leaves -- ensure hit leaves come back front to back.
+        """
+        hits = self.test_tree.ray_leaves((-1.0, 0.5, 0.5), (1.0, 0.0, 0.0))
+        self.assertEqual([leaf.points[0] for t, leaf in hits],
+                         self.test_points[:3])
+        hits = list(self.test_tree.ray_leaves((-1.0, 0.5, 0.5), 
+            (1.0, 0.0, 0.0), occupied_only=False))
+        t_values = [t for t, leaf in hits]
+        self.assertEqual(t_values, sorted(t_values))
+
+    def test_nearest(self):
+        """
+        test_nearest -- ensure nearest and points_within agree with a brute
+        force search.
+        """
+        query = (5.0, 1.0, 1.0)
+        distances = sorted([(math.sqrt(sum([(p[i]-query[i])**2 for i in 
+            range(3)])), p) for p in self.test_points])
+        self.assertEqual(self.test_tree.nearest(query), distances[0])
+        self.assertEqual(self.test_tree.nearest(query, max_distance=0.5),
+                         (INFINITY, None))
+        self.assertEqual(sorted(self.test_tree.points_within(query, 5.0)),
+                         [d for d in distances if d[0] <= 5.0])
+
+    def test_save_load(self):
+        """
+        test_save_load -- ensure a saved tree answers queries the same once
+        memory mapped.
+        """
+        import tempfile
+        handle, file_path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            self.test_tree.save(file_path)
+            with load(file_path) as mapped_tree:
+                for point in self.test_points:
+                    leaf = mapped_tree.leaf_containing(point)
+                    check = self.test_tree.leaf_containing(point)
+                    self.assertEqual(leaf.points, check.points)
+                    self.assertEqual(leaf.bp_min, check.bp_min)
+                    self.assertEqual(leaf.bp_max, check.bp_max)
+                leaf = mapped_tree.ray_pick((9.0, 0.5, 0.5), 
+                        (-1.0, 0.0, 0.0))
+                self.assertEqual(leaf.points, [(7.5, 0.5, 0.5)])
+                self.assertEqual(mapped_tree.stats()['leaf_occupancy'],
+                                 self.test_tree.stats()['leaf_occupancy'])
+        finally:
+            os.remove(file_path)
+
+    def test_insert_points_parallel(self):
+        """
+        test_insert_points_parallel -- ensure the parallel build matches the
+        serial one.
+        """
+        import random
+        rand = random.Random(256)
+        points = [(rand.random()*8.0, rand.random()*8.0, rand.random()*8.0)
+                  for i in range(500)]
+        serial_tree = OctTree((0.0, 0.0, 0.0), (8.0, 8.0, 8.0),
+                max_division=5, leaf_capacity=4)
+        serial_tree.insert_points(points)
+        for split_level in [1, 2]:
+            parallel_tree = OctTree((0.0, 0.0, 0.0), (8.0, 8.0, 8.0),
+                    max_division=5, leaf_capacity=4)
+            parallel_tree.insert_points_parallel(points, processes=2,
+                    split_level=split_level)
+            self.assertEqual(_flatten_nodes(parallel_tree.root),
+                             _flatten_nodes(serial_tree.root))
+            self.assertEqual(parallel_tree.stats()['timings']['build']
+                    ['calls'], 1)
+
+    def test_leaf_indices(self):
+        """
+        test_leaf_indices -- ensure quantized indices land on the same leaves
+        as a subdivided tree.
+        """
+        indices = self.test_tree.leaf_indices(self.test_points, 3)
+        self.assertEqual(len(indices), len(self.test_points))
+        centers = set([self.test_tree.leaf_center(i, 3) for i in indices])
+        check = set([self.test_tree.leaf_containing(p).half_values 
+                     for p in self.test_points])
+        self.assertEqual(centers, check)
+
+    def test_stats(self):
+        """
+        test_stats -- ensure node counts and occupancy are reported.
+        """
+        stats = self.test_tree.stats()
+        self.assertEqual(stats['max_depth'], 3)
+        self.assertEqual(stats['point_count'], 4)
+        self.assertEqual(stats['leaf_occupancy'][1], 4)
+        self.assertEqual(stats['node_count'], 
+                         sum(stats['nodes_per_depth'].values()))
+        self.assertEqual(stats['leaf_count'], stats['node_count']//8*7+1)
+        self.assertEqual(stats['timings']['build']['calls'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,524 @@
+__doc__ = """
+A Maya-free geometry kernel for quickCity buildings. Buildings are grown from
+a face by the same extrusion vocabulary extrudeList uses ('up', 'down', 'in',
+'out', 'antenna'), but the vertices and faces are generated directly into a
+MeshBuffer instead of through polyExtrudeFacet and setAttr calls. Any number
+of buildings can be appended to one buffer, which is then created in Maya as
+a single mesh or written to an OBJ file.
+"""
+
+# Standard Imports
+import array, math, unittest
+from timeit import default_timer
+
+# Non-standard Imports
+import extrudeRecipe
+
+# Maya Imports
+MAYA_MODE = True
+try:
+    import maya.cmds as cmds
+    import maya.api.OpenMaya as om
+except ImportError:
+    MAYA_MODE = False
+
+# Globals
+# The number of buildings streamBuildings generates between writes.
+CHUNK_SIZE = 1000
+
+# Exceptions
+class BuildingGeometryError(Exception):pass
+
+# Classes
+class MeshBuffer(object):
+    """
+    A polygon mesh held in flat arrays: points is [x0, y0, z0, x1, ...],
+    faceCounts holds the number of vertices of each face and faceConnects
+    the vertex indices of every face, one face after the other. This is the
+    layout MFnMesh.create takes. shellEnds holds the face count at the end of
+    each shell closed by a FaceExtruder, so the last face of each shell is
+    its top.
+    """
+    def __init__(self):
+        self.points = array.array('d')
+        self.faceCounts = array.array('i')
+        self.faceConnects = array.array('i')
+        self.shellEnds = array.array('i')
+        self._faceOffsets = array.array('i', [0])
+
+    @property
+    def vertexCount(self):
+        return len(self.points)//3
+
+    @property
+    def faceCount(self):
+        return len(self.faceCounts)
+
+    def addVertex(self, x, y, z):
+        """
+        Adds a vertex and returns its index.
+        """
+        self.points.extend((x, y, z))
+        return len(self.points)//3 - 1
+
+    def addFace(self, vertices):
+        """
+        Adds a face through the given vertex indices.
+        """
+        self.faceCounts.append(len(vertices))
+        self.faceConnects.extend(vertices)
+
+    def facePositions(self, face):
+        """
+        Returns a flat [x0, y0, z0, x1, ...] list of the positions of the
+        vertices of the face with the given index, like
+        MeshTopology.facePositions, so a buffer read with readObj can stand
+        in for a mesh in Maya.
+        """
+        offsets = self._faceOffsets
+        for count in self.faceCounts[len(offsets)-1:]:
+            offsets.append(offsets[-1] + count)
+        points = self.points
+        positions = []
+        for v in self.faceConnects[offsets[face]:offsets[face+1]]:
+            positions.extend(points[3*v:3*v+3])
+        return positions
+
+    def clear(self):
+        """
+        Empties the buffer.
+        """
+        self.__init__()
+
+    def extend(self, other):
+        """
+        Appends the vertices and faces of another MeshBuffer.
+        """
+        offset = self.vertexCount
+        self.shellEnds.extend([f+self.faceCount for f in other.shellEnds])
+        self.points.extend(other.points)
+        self.faceCounts.extend(other.faceCounts)
+        self.faceConnects.extend([v+offset for v in other.faceConnects])
+
+    def create(self, name):
+        """
+        Creates the buffer in Maya as a single mesh named name, with one API
+        call, and returns the name of its transform.
+        """
+        if not MAYA_MODE:
+            raise BuildingGeometryError("Meshes can only be created in Maya")
+        points = self.points
+        vertices = [om.MPoint(points[i], points[i+1], points[i+2]) for i in
+                range(0, len(points), 3)]
+        transform = om.MFnMesh().create(vertices, list(self.faceCounts),
+                list(self.faceConnects))
+        name = om.MFnDependencyNode(transform).setName(name)
+        cmds.sets(name, e=True, forceElement='initialShadingGroup')
+        return name
+
+    def writeObj(self, filePath):
+        """
+        Writes the buffer to filePath as a Wavefront OBJ file.
+        """
+        with ObjWriter(filePath) as writer:
+            writer.write(self)
+
+
+class ObjWriter(object):
+    """
+    Writes MeshBuffers to one Wavefront OBJ file one after the other, 
+    keeping a running vertex offset, so a city can be written a chunk at a
+    time as it is generated instead of held in memory whole. Use it as a
+    context manager, or call close() when done.
+    """
+    def __init__(self, filePath):
+        self.file = open(filePath, 'w')
+        self.vertexCount = 0
+        self.faceCount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, mesh):
+        """
+        Appends the vertices and faces of mesh to the file.
+        """
+        points = mesh.points
+        faceConnects = mesh.faceConnects
+        offset = self.vertexCount + 1
+        lines = ['v %r %r %r\n' % (points[i], points[i+1], points[i+2]) for
+                i in range(0, len(points), 3)]
+        start = 0
+        for count in mesh.faceCounts:
+            lines.append('f %s\n' % ' '.join([str(v+offset) for v in
+                faceConnects[start:start+count]]))
+            start += count
+        self.file.write(''.join(lines))
+        self.vertexCount += mesh.vertexCount
+        self.faceCount += mesh.faceCount
+
+    def close(self):
+        self.file.close()
+
+
+class FaceExtruder(object):
+    """
+    Grows geometry from a single face into a MeshBuffer. The face is held as
+    a ring of vertex indices; each extrusion adds a new ring, moved along the
+    face normal and scaled about the face center in the face's local x and y
+    axes, and joins it to the previous ring with side quads, like
+    polyExtrudeFacet. close() adds the final top face.
+    """
+    def __init__(self, mesh, positions):
+        """
+        @param mesh MeshBuffer
+            The buffer to add geometry to.
+        @param positions list
+            The flat [x0, y0, z0, x1, ...] positions of the starting face, as
+            cmds.xform returns them for a face component.
+        """
+        if len(positions) < 9:
+            raise BuildingGeometryError("A face needs at least 3 vertices")
+        self.mesh = mesh
+        self.ring = [mesh.addVertex(*positions[i:i+3]) for i in
+                range(0, len(positions), 3)]
+        count = len(self.ring)
+        self.center = [sum(positions[axis::3])/float(count) for axis in
+                range(3)]
+
+        # The face normal by Newell's method, and a local x axis along the
+        # first edge.
+        normal = [0.0, 0.0, 0.0]
+        for i in range(count):
+            x1, y1, z1 = positions[3*i:3*i+3]
+            x2, y2, z2 = positions[3*((i+1)%count):3*((i+1)%count)+3]
+            normal[0] += (y1-y2)*(z1+z2)
+            normal[1] += (z1-z2)*(x1+x2)
+            normal[2] += (x1-x2)*(y1+y2)
+        xAxis = [positions[3+axis]-positions[axis] for axis in range(3)]
+        self.normal = _normalized(normal)
+        self.xAxis = _normalized(xAxis)
+        self.yAxis = _cross(self.normal, self.xAxis)
+
+    def extrude(self, translate=0.0, scaleX=1.0, scaleY=1.0):
+        """
+        Extrudes the current face translate units along its normal, scaling
+        it by scaleX and scaleY in its local axes.
+        """
+        mesh = self.mesh
+        points = mesh.points
+        cx, cy, cz = self.center
+        nx, ny, nz = self.normal
+        xx, xy, xz = self.xAxis
+        yx, yy, yz = self.yAxis
+        ring = []
+        for v in self.ring:
+            dx = points[3*v]-cx; dy = points[3*v+1]-cy; dz = points[3*v+2]-cz
+            u = (dx*xx + dy*xy + dz*xz)*(scaleX-1.0)
+            w = (dx*yx + dy*yy + dz*yz)*(scaleY-1.0)
+            ring.append(mesh.addVertex(
+                points[3*v] + u*xx + w*yx + translate*nx,
+                points[3*v+1] + u*xy + w*yy + translate*ny,
+                points[3*v+2] + u*xz + w*yz + translate*nz))
+        count = len(ring)
+        for i in range(count):
+            j = (i+1) % count
+            mesh.addFace([self.ring[i], self.ring[j], ring[j], ring[i]])
+        self.ring = ring
+        self.center = [cx + translate*nx, cy + translate*ny,
+                       cz + translate*nz]
+
+    def applyOps(self, ops):
+        """
+        Performs a sequence of extrudeRecipe.ExtrudeOps.
+        """
+        for op in ops:
+            self.extrude(op.translate, op.scaleX, op.scaleY)
+
+    def extrudeList(self, extrudes, heights, scales):
+        """
+        Performs the extrudes in order, as quickCity.extrudeList does, taking
+        a height from heights for each 'up', 'down' or 'antenna' and a scale
+        from scales for each 'in' or 'out'. The height for down is a positive
+        number.
+        """
+        self.applyOps(extrudeRecipe.compileRecipe(extrudes, heights, scales))
+
+    def close(self):
+        """
+        Adds the current face to the mesh, ending the shell.
+        """
+        self.mesh.addFace(self.ring)
+        self.mesh.shellEnds.append(self.mesh.faceCount)
+
+
+class BoxProxy(object):
+    """
+    A cheap preview of a planned block: one mesh holding a box per building,
+    from the building's face up to its extrudeRecipe.buildingTop. Replanning
+    a block with new heights or levels keeps the same buildings, so an update
+    usually moves only the top vertices of each box, in place, rather than
+    creating a new mesh.
+    """
+    def __init__(self, name):
+        """
+        @param name string
+            The name of the preview mesh in Maya.
+        """
+        self.name = name
+        self.node = None
+        self.mesh = None
+        self.faceIndices = None
+        # Per box: the index of its first vertex, its vertex count per ring
+        # and its face normal.
+        self.boxes = []
+
+    def setBoxes(self, plan, topology):
+        """
+        Fits the boxes to a cityPlan.BuildingPlan. Returns True if the mesh
+        was rebuilt because the plan has different buildings, False if only
+        the box tops moved.
+
+        @param topology meshTopology.MeshTopology
+            The block's mesh, to read face positions from.
+        """
+        tops = extrudeRecipe.planTops(plan)
+        if self.mesh is None or self.faceIndices != plan.faceIndices:
+            self.mesh = MeshBuffer()
+            self.boxes = []
+            for faceIndex, top in zip(plan.faceIndices, tops):
+                start = self.mesh.vertexCount
+                extruder = FaceExtruder(self.mesh,
+                        topology.facePositions(faceIndex))
+                extruder.extrude(top)
+                extruder.close()
+                self.boxes.append((start, len(extruder.ring),
+                    extruder.normal))
+            self.faceIndices = array.array('i', plan.faceIndices)
+            return True
+
+        points = self.mesh.points
+        for (start, count, (nx, ny, nz)), top in zip(self.boxes, tops):
+            for v in range(3*start, 3*(start+count), 3):
+                t = v + 3*count
+                points[t] = points[v] + top*nx
+                points[t+1] = points[v+1] + top*ny
+                points[t+2] = points[v+2] + top*nz
+        return False
+
+    def update(self, plan, topology):
+        """
+        Shows plan in Maya, creating the preview mesh if its buildings
+        changed or it no longer exists, and otherwise setting its points.
+        """
+        if not MAYA_MODE:
+            raise BuildingGeometryError("Previews can only be shown in Maya")
+        rebuilt = self.setBoxes(plan, topology)
+        if self.node is None or not cmds.objExists(self.node):
+            rebuilt = True
+        if rebuilt:
+            self.delete()
+            self.node = self.mesh.create(self.name)
+            return
+        points = self.mesh.points
+        selection = om.MSelectionList()
+        selection.add(self.node)
+        meshFn = om.MFnMesh(selection.getDagPath(0))
+        meshFn.setPoints(om.MPointArray([om.MPoint(points[i], points[i+1],
+            points[i+2]) for i in range(0, len(points), 3)]))
+        meshFn.updateSurface()
+
+    def delete(self):
+        """
+        Deletes the preview mesh.
+        """
+        if self.node is not None and cmds.objExists(self.node):
+            cmds.delete(self.node)
+        self.node = None
+
+
+# Functions
+def addBuilding(mesh, positions, spec, sidewalkHeight):
+    """
+    Adds the building described by a cityPlan.BuildingSpec, grown from the
+    face with the given flat positions, to mesh. This mirrors
+    CityBlock.buildFromSpec.
+    """
+    extruder = FaceExtruder(mesh, positions)
+    extruder.applyOps(extrudeRecipe.buildingOps(spec, sidewalkHeight))
+    extruder.close()
+    return extruder
+
+def readObj(filePath):
+    """
+    Reads the vertices and faces of a Wavefront OBJ file into a MeshBuffer,
+    e.g. a block's target mesh exported from Maya, so its buildings can be
+    generated where Maya isn't available.
+    """
+    mesh = MeshBuffer()
+    with open(filePath) as f:
+        for line in f:
+            values = line.split()
+            if not values:
+                continue
+            if values[0] == 'v':
+                mesh.addVertex(*[float(v) for v in values[1:4]])
+            elif values[0] == 'f':
+                vertices = [int(v.split('/')[0]) for v in values[1:]]
+                mesh.addFace([v-1 if v > 0 else mesh.vertexCount+v for v in
+                    vertices])
+    return mesh
+
+def streamBuildings(plan, facePositions, writer, chunkSize=CHUNK_SIZE):
+    """
+    Generates the buildings of a cityPlan.BuildingPlan chunkSize at a time,
+    writing each chunk to writer and reusing the buffer, so memory use does
+    not grow with the size of the plan. Returns (buildings, seconds).
+
+    @param facePositions function
+        Returns the flat positions of a face given its index, e.g. 
+        MeshTopology.facePositions.
+    @param writer ObjWriter
+        Where to write the buildings.
+    """
+    start = default_timer()
+    mesh = MeshBuffer()
+    sidewalkHeight = plan.sidewalkHeight
+    for spec in plan:
+        addBuilding(mesh, facePositions(spec.faceIndex), spec, sidewalkHeight)
+        if len(mesh.shellEnds) >= chunkSize:
+            writer.write(mesh)
+            mesh.clear()
+    writer.write(mesh)
+    return len(plan), default_timer()-start
+
+def _normalized(v):
+    length = math.sqrt(v[0]*v[0] + v[1]*v[1] + v[2]*v[2])
+    if not length:
+        raise BuildingGeometryError("Face is degenerate")
+    return [v[0]/length, v[1]/length, v[2]/length]
+
+def _cross(a, b):
+    return [a[1]*b[2]-a[2]*b[1], a[2]*b[0]-a[0]*b[2], a[0]*b[1]-a[1]*b[0]]
+
+
+# Tests
+class TestBuildingGeometry(unittest.TestCase):
+    def setUp(self):
+        self.test_mesh = MeshBuffer()
+        self.test_face = [0, 0, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0]
+
+    def test_extrude(self):
+        """
+        test_extrude -- ensure extrusions add a ring and its side quads, and
+        move and scale the face in its own frame.
+        """
+        extruder = FaceExtruder(self.test_mesh, self.test_face)
+        extruder.extrudeList(['up', 'in'], [2.0], [0.5])
+        extruder.close()
+        self.assertEqual(self.test_mesh.vertexCount, 12)
+        self.assertEqual(self.test_mesh.faceCount, 9)
+        top = self.test_mesh.points[-12:].tolist()
+        self.assertEqual(top, [0.25, 0.25, 2, 0.75, 0.25, 2, 0.75, 0.75, 2,
+                               0.25, 0.75, 2])
+
+    def test_bad_recipe(self):
+        """
+        test_bad_recipe -- ensure mismatched or unknown extrudes are refused.
+        """
+        extruder = FaceExtruder(self.test_mesh, self.test_face)
+        self.assertRaises(extrudeRecipe.RecipeError, extruder.extrudeList,
+                ['up', 'in'], [1.0], [])
+        self.assertRaises(extrudeRecipe.RecipeError, extruder.extrudeList,
+                ['sideways'], [1.0], [])
+
+    def test_write_obj(self):
+        """
+        test_write_obj -- ensure buffers are written as 1-indexed OBJ.
+        """
+        import os, tempfile
+        extruder = FaceExtruder(self.test_mesh, self.test_face)
+        extruder.close()
+        handle, filePath = tempfile.mkstemp(suffix='.obj')
+        os.close(handle)
+        try:
+            self.test_mesh.writeObj(filePath)
+            with open(filePath) as f:
+                lines = f.read().splitlines()
+        finally:
+            os.remove(filePath)
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[-1], 'f 1 2 3 4')
+
+    def test_stream(self):
+        """
+        test_stream -- ensure buildings streamed in chunks give the same file
+        as writing them from one buffer.
+        """
+        import cityPlan, os, tempfile
+        plan = cityPlan.planBlock('testBlock', range(30))
+        facePositions = lambda i: [i, 0, 0, i+1, 0, 0, i+1, 1, 0, i, 1, 0]
+        for spec in plan:
+            addBuilding(self.test_mesh, facePositions(spec.faceIndex), spec,
+                    plan.sidewalkHeight)
+        handle, filePath = tempfile.mkstemp(suffix='.obj')
+        os.close(handle)
+        try:
+            self.test_mesh.writeObj(filePath)
+            with open(filePath) as f:
+                whole = sorted(f.read().splitlines())
+            with ObjWriter(filePath) as writer:
+                count, seconds = streamBuildings(plan, facePositions, writer,
+                        chunkSize=4)
+            with open(filePath) as f:
+                streamed = sorted(f.read().splitlines())
+        finally:
+            os.remove(filePath)
+        self.assertEqual(count, len(plan))
+        self.assertEqual(streamed, whole)
+
+    def test_read_obj(self):
+        """
+        test_read_obj -- ensure faces read back from an OBJ file have the
+        positions they were written with.
+        """
+        import os, tempfile
+        FaceExtruder(self.test_mesh, self.test_face).close()
+        handle, filePath = tempfile.mkstemp(suffix='.obj')
+        os.close(handle)
+        try:
+            self.test_mesh.writeObj(filePath)
+            mesh = readObj(filePath)
+        finally:
+            os.remove(filePath)
+        self.assertEqual(mesh.facePositions(0), self.test_face)
+
+    def test_box_proxy(self):
+        """
+        test_box_proxy -- ensure replanning with new heights moves the box
+        tops in place, and a plan with other buildings rebuilds the boxes.
+        """
+        import cityPlan
+        class Grid(object):
+            def facePositions(self, faceIndex):
+                x = float(faceIndex)
+                return [x, 0, 0, x+1, 0, 0, x+1, 1, 0, x, 1, 0]
+        proxy = BoxProxy('testPreview')
+        plan = cityPlan.planBlock('testBlock', range(50))
+        self.assertTrue(proxy.setBoxes(plan, Grid()))
+        faceCount = proxy.mesh.faceCount
+        taller = cityPlan.planBlock('testBlock', range(50), minHeight=10,
+                maxHeight=20)
+        self.assertFalse(proxy.setBoxes(taller, Grid()))
+        self.assertEqual(proxy.mesh.faceCount, faceCount)
+        tops = extrudeRecipe.planTops(taller)
+        self.assertEqual(proxy.mesh.points[14], tops[0])
+        self.assertTrue(proxy.setBoxes(cityPlan.planBlock('testBlock',
+            range(40)), Grid()))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
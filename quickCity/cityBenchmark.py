@@ -0,0 +1,160 @@
+__doc__ = """
+Benchmarks quickCity outside Maya. A cmdBuffer.ProfilingCmds is installed as
+maya.cmds, answering the scene queries quickCity makes for synthetic grid
+meshes, and blocks of several sizes are set up, planned and built on it.
+Each phase reports its wall time along with the calls it made per command
+type and their simulated Maya cost, giving a baseline to measure quickCity
+changes against. Run it as a script with the grid sizes to try, e.g.
+python cityBenchmark.py 10 30 100.
+"""
+
+# Standard Imports
+import os, sys, types
+from timeit import default_timer
+
+# Non-standard Imports
+if __name__ == '__main__':
+    # Run as a script, only quickCity/ is on the path; cmdBuffer and the
+    # other shared modules are in the repository root above it.
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(
+        __file__))))
+import cmdBuffer
+
+# Globals
+SIZES = [10, 30, 100]
+BUILD_TYPES = ['mesh', 'plane', 'instance', 'geometry']
+PHASES = ['setup', 'plan', 'build']
+
+# Classes
+class SyntheticGrid(object):
+    """
+    A size by size grid of unit quads in the xy plane, answering the queries
+    quickCity makes about a mesh the way maya.cmds would.
+    """
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        row = size+1
+        self.positions = []
+        for y in range(row):
+            for x in range(row):
+                self.positions.extend([float(x), float(y), 0.0])
+        self.faceLines = []
+        self.edgeLines = []
+        for y in range(size):
+            for x in range(size):
+                v = y*row + x
+                self.faceLines.append('FACE %d: %d %d %d %d\n' % (
+                    len(self.faceLines), v, v+1, v+row+1, v+row))
+        for y in range(row):
+            for x in range(size):
+                v = y*row + x
+                self.edgeLines.append('EDGE %d: %d %d Hard\n' % (
+                    len(self.edgeLines), v, v+1))
+
+    @property
+    def faceCount(self):
+        return self.size*self.size
+
+    def returnValues(self):
+        """
+        Returns the return values for a cmdBuffer.RecordingCmds standing in
+        for a scene holding the grid.
+        """
+        def polyEvaluate(mesh, v=False, f=False, e=False):
+            if v:
+                return len(self.positions)//3
+            if f:
+                return self.faceCount
+            return len(self.edgeLines)
+        def polyInfo(mesh, edgeToVertex=False, faceToVertex=False):
+            if faceToVertex:
+                return self.faceLines
+            return self.edgeLines
+        return {'polyEvaluate': polyEvaluate, 'polyInfo': polyInfo,
+                'xform': lambda *args, **kwargs: self.positions,
+                'listRelatives': [self.name], 'ls': [],
+                'objExists': True, 'progressWindow': False,
+                'group': lambda *args, **kwargs: kwargs.get('name')}
+
+
+# Functions
+def installFakeMaya(fakeCmds):
+    """
+    Installs fakeCmds as maya.cmds. Must be called before quickCity and the
+    modules it uses are imported.
+    """
+    maya = types.ModuleType('maya')
+    maya.cmds = fakeCmds
+    sys.modules['maya'] = maya
+    sys.modules['maya.cmds'] = fakeCmds
+    cmdBuffer.cmds = fakeCmds
+
+def runBenchmark(sizes=SIZES, buildTypes=BUILD_TYPES, fakeCmds=None):
+    """
+    Sets up, plans and builds a block on a grid of each size with each build
+    type. Geometry blocks can't be created without Maya, so their build
+    phase only generates the geometry. Returns a list of result dicts, one
+    per block, with the block's faces and buildings, and for each phase its
+    wall time, simulated time and profile as ProfilingCmds.profile gives it.
+    """
+    if fakeCmds is None:
+        fakeCmds = cmdBuffer.ProfilingCmds()
+        installFakeMaya(fakeCmds)
+    import meshTopology
+    import quickCity
+
+    results = []
+    for size in sizes:
+        grid = SyntheticGrid('grid%d' % size, size)
+        fakeCmds.returnValues = grid.returnValues()
+        for buildType in buildTypes:
+            meshTopology.invalidate()
+            result = {'size': size, 'buildType': buildType,
+                    'faces': grid.faceCount}
+            phases = [
+                ('setup', lambda: quickCity.CityBlock('bench', 'source',
+                    grid.name, buildType, centerFaces=[grid.name+'.f[0]'])),
+                ('plan', lambda: block.plan()),
+                ('build', lambda: block.buildGeometry(plan) if
+                    buildType == 'geometry' else block.build(plan)),
+            ]
+            for phase, run in phases:
+                fakeCmds.reset()
+                start = default_timer()
+                value = run()
+                result[phase] = (default_timer()-start,
+                        fakeCmds.simulatedTime(), fakeCmds.profile())
+                if phase == 'setup':
+                    block = value
+                elif phase == 'plan':
+                    plan = value
+            result['buildings'] = len(plan)
+            results.append(result)
+    return results
+
+def report(results):
+    """
+    Returns the results of runBenchmark as text: a line per phase of each
+    block with its wall and simulated seconds, followed by its calls per
+    command type.
+    """
+    lines = []
+    for result in results:
+        lines.append('%s block, %d faces, %d buildings' % (
+            result['buildType'], result['faces'], result['buildings']))
+        for phase in PHASES:
+            wall, simulated, profile = result[phase]
+            calls = sum([p[0] for p in profile.values()])
+            lines.append('  %-6s wall %8.3fs  simulated %8.3fs  %6d calls' %
+                    (phase, wall, simulated, calls))
+            for name, (count, items, seconds) in sorted(profile.items(),
+                    key=lambda item: -item[1][2]):
+                lines.append('    %-22s %6d calls %8d items %8.3fs' % (name,
+                    count, items, seconds))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    print(report(runBenchmark(sizes)))
@@ -0,0 +1,202 @@
+__doc__ = """
+District influence fields for quickCity. A city can have any number of
+district centers; the centers are held in an OctTree, and faces are
+bucketed into cells so that the centers near each cell are found with one
+tree search. The distance from a face to its nearest center, or the
+influence of the centers around it, is then taken over those few centers
+rather than over every center for every face.
+
+octTree is found at the root of the repository, as quickCity finds
+cmdBuffer and meshTopology, so the root must be on the path. To run the
+tests from quickCity/, use PYTHONPATH=.. python cityDistricts.py.
+"""
+
+# Standard Imports
+import array, math, unittest
+
+# Non-standard Imports
+import cityPlan
+import cityRandom
+import octTree
+
+# Globals
+MAX_DIVISION = 10
+LEAF_CAPACITY = 8
+
+# Exceptions
+class CityDistrictsError(Exception):pass
+
+# Classes
+class DistrictField(object):
+    """
+    A set of weighted district centers. Influence falls off smoothly from a
+    center's weight at the center to nothing at the falloff radius, and a
+    point takes the strongest influence of the centers around it.
+    """
+    def __init__(self, centers, weights=None):
+        """
+        @param centers list
+            The (x, y, z) positions of the district centers.
+        @param weights list
+            The influence of each center, 1.0 for every center by default.
+        """
+        if not centers:
+            raise CityDistrictsError("At least one district center is needed")
+        centers = [tuple(c) for c in centers]
+        if weights is None:
+            weights = [1.0]*len(centers)
+        if len(weights) != len(centers):
+            raise CityDistrictsError("Expected a weight for each center")
+        self.centers = centers
+        self.weights = {}
+        for center, weight in zip(centers, weights):
+            self.weights[center] = max(weight, self.weights.get(center, 0.0))
+
+        bpMin = tuple([min([c[axis] for c in centers]) for axis in range(3)])
+        bpMax = tuple([max([c[axis] for c in centers]) for axis in range(3)])
+        self.tree = octTree.OctTree(bpMin, bpMax, max_division=MAX_DIVISION,
+                leaf_capacity=LEAF_CAPACITY)
+        self.tree.insert_points(centers)
+
+    def distances(self, points):
+        """
+        Returns an array of the distance from each point to its nearest
+        center.
+
+        @param points list
+            Flat [x0, y0, z0, x1, ...] positions, as getFaceMidpoints gives.
+        """
+        distances = array.array('d', [0.0])*(len(points)//3)
+        for center, halfDiagonal, indices in self._cells(points):
+            # Every point in the cell is within bound of some center, so no
+            # center further than bound from any of them can be nearest.
+            bound = self.tree.nearest(center)[0] + 2*halfDiagonal
+            candidates = [c for d, c in self.tree.points_within(center, 
+                bound)]
+            for i in indices:
+                x, y, z = points[3*i:3*i+3]
+                best = octTree.INFINITY
+                for cx, cy, cz in candidates:
+                    d2 = (x-cx)*(x-cx) + (y-cy)*(y-cy) + (z-cz)*(z-cz)
+                    if d2 < best:
+                        best = d2
+                distances[i] = math.sqrt(best)
+        return distances
+
+    def influences(self, points, radius):
+        """
+        Returns an array of the influence at each point, in [0, 1] for
+        weights of at most 1. A center of weight w at distance d contributes
+        w*(1-(d/radius)**2)**2 and each point takes the largest contribution.
+
+        @param points list
+            Flat [x0, y0, z0, x1, ...] positions, as getFaceMidpoints gives.
+        @param radius float
+            The distance at which a center's influence reaches 0.
+        """
+        if radius <= 0:
+            raise CityDistrictsError("The falloff radius must be positive")
+        influences = array.array('d', [0.0])*(len(points)//3)
+        r2 = radius*radius
+        for center, halfDiagonal, indices in self._cells(points):
+            candidates = [c + (self.weights[c],) for d, c in 
+                    self.tree.points_within(center, radius+halfDiagonal)]
+            if not candidates:
+                continue
+            for i in indices:
+                x, y, z = points[3*i:3*i+3]
+                influence = 0.0
+                for cx, cy, cz, weight in candidates:
+                    d2 = (x-cx)*(x-cx) + (y-cy)*(y-cy) + (z-cz)*(z-cz)
+                    if d2 < r2:
+                        t = 1.0 - d2/r2
+                        influence = max(influence, weight*t*t)
+                influences[i] = influence
+        return influences
+
+    def _cells(self, points):
+        """
+        Buckets points into cubic cells about as wide as the spacing between
+        centers, so the centers near a cell are looked up in the tree once
+        for all of its points. Yields (cell center, cell half diagonal, 
+        point indices) for each occupied cell.
+        """
+        bpMin, bpMax = self.tree.bp_min, self.tree.bp_max
+        extent = max([bpMax[axis]-bpMin[axis] for axis in range(3)])
+        size = extent/len(self.centers)**0.5 or 1.0
+        cells = {}
+        for i in range(len(points)//3):
+            key = (int(math.floor(points[3*i]/size)), 
+                   int(math.floor(points[3*i+1]/size)),
+                   int(math.floor(points[3*i+2]/size)))
+            cells.setdefault(key, []).append(i)
+        halfDiagonal = size*0.5*3**0.5
+        for key, indices in cells.items():
+            center = tuple([(k+0.5)*size for k in key])
+            yield center, halfDiagonal, indices
+
+# Functions
+def planBlock(blockName, faceIndices, midpoints, centers, weights=None,
+        falloffRadius=None, seed=cityRandom.SEED, minHeight=1, maxHeight=5,
+        minLevels=1, maxLevels=5, dropRate=0.1):
+    """
+    Plans a block with cityPlan.planBlock, scaling building heights by the
+    influence of the district centers at each face if a falloffRadius is
+    given. Takes only plain data, so blocks can be planned in worker 
+    processes.
+
+    @param midpoints list
+        The flat midpoints of the faces, in the order of faceIndices.
+    @param centers list
+        The (x, y, z) positions of the district centers.
+    @param weights list
+        The influence of each center.
+    @param falloffRadius float
+        The distance at which a center's influence reaches 0.
+    """
+    heightScales = None
+    if falloffRadius:
+        heightScales = DistrictField(centers, weights).influences(midpoints,
+                falloffRadius)
+    return cityPlan.planBlock(blockName, faceIndices, seed, minHeight,
+            maxHeight, minLevels, maxLevels, dropRate, heightScales)
+
+
+# Tests
+class TestCityDistricts(unittest.TestCase):
+    def setUp(self):
+        self.test_centers = [(float(x), float(y), 0.0) for x in range(0, 100,
+            10) for y in range(0, 100, 25)]
+        self.test_points = array.array('d')
+        for i in range(200):
+            self.test_points.extend(((i*37) % 101, (i*53) % 97, 0.0))
+
+    def test_distances(self):
+        """
+        test_distances -- ensure nearest center distances match a brute force
+        search.
+        """
+        field = DistrictField(self.test_centers)
+        distances = field.distances(self.test_points)
+        for i, distance in enumerate(distances):
+            x, y, z = self.test_points[3*i:3*i+3]
+            check = min([((x-cx)**2 + (y-cy)**2)**0.5 for cx, cy, cz in
+                self.test_centers])
+            self.assertAlmostEqual(distance, check)
+
+    def test_influences(self):
+        """
+        test_influences -- ensure influence is the weight at a center and
+        nothing beyond the radius.
+        """
+        field = DistrictField([(0.0, 0.0, 0.0), (10.0, 0.0, 0.0)],
+                [1.0, 0.5])
+        influences = field.influences([0, 0, 0, 10, 0, 0, 5, 0, 0, 30, 0, 0],
+                8.0)
+        self.assertEqual(influences.tolist()[:2], [1.0, 0.5])
+        self.assertAlmostEqual(influences[2], (1-(5/8.0)**2)**2)
+        self.assertEqual(influences[3], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
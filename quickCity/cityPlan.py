@@ -0,0 +1,415 @@
+__doc__ = """
+The planning phase of quickCity. A plan is a compact table of building specs,
+one row per building, computed in pure Python from a block's parameters and
+face indices without touching Maya. Plans can be saved to disk and handed to
+CityBlock.buildMesh/buildPlanes to execute, and because every face draws from
+its own cityRandom stream, planning a face always gives the same building.
+"""
+
+# Standard Imports
+import array, collections, struct, sys, unittest
+
+# Non-standard Imports
+import cityRandom
+
+# Globals
+PRESET_TYPES = ['indent', 'rim', 'well']
+ANTENNA_CHANCE = 0.6
+HEIGHT_STEPS = 16
+
+# Plan file layout: a header, the UTF-8 block name, then the faceIndices,
+# heights, levels, presets, antennas, scaleOffsets and scales arrays. Array
+# lengths follow from the building and scale counts in the header. Everything
+# is little endian.
+PLAN_MAGIC = b'QCP1'
+HEADER_STRUCT = struct.Struct('<4sIIddiidII')
+
+# Exceptions
+class CityPlanError(Exception):pass
+
+# Classes
+BuildingSpec = collections.namedtuple('BuildingSpec', ['faceIndex', 'height',
+    'levels', 'presetType', 'scales', 'antenna'])
+
+
+class BuildingPlan(object):
+    """
+    The building specs for a block, stored column-wise in flat arrays. Each
+    building has a face index, a height, a number of levels, a preset type
+    (an index into PRESET_TYPES), an antenna flag and 2 scales (x, y) for
+    every level above the first, found in scales between scaleOffsets[i] and
+    scaleOffsets[i+1]. Indexing or iterating a plan gives BuildingSpecs.
+    """
+    def __init__(self, blockName, seed, minHeight, maxHeight, minLevels,
+            maxLevels, dropRate):
+        """
+        @param blockName string
+            The name of the block the plan is for.
+        @param seed int
+            The seed the plan was drawn with.
+        @param minHeight, maxHeight float
+            The range of building heights.
+        @param minLevels, maxLevels int
+            The range of building levels, maxLevels exclusive.
+        @param dropRate float
+            The chance of a face getting no building.
+        """
+        self.blockName = blockName
+        self.seed = seed
+        self.minHeight = minHeight
+        self.maxHeight = maxHeight
+        self.minLevels = minLevels
+        self.maxLevels = maxLevels
+        self.dropRate = dropRate
+        self.faceIndices = array.array('i')
+        self.heights = array.array('d')
+        self.levels = array.array('i')
+        self.presets = array.array('b')
+        self.antennas = array.array('b')
+        self.scaleOffsets = array.array('i', [0])
+        self.scales = array.array('d')
+
+    def __len__(self):
+        return len(self.faceIndices)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        scales = self.scales[self.scaleOffsets[i]:self.scaleOffsets[i+1]]
+        return BuildingSpec(self.faceIndices[i], self.heights[i],
+                self.levels[i], PRESET_TYPES[self.presets[i]],
+                scales.tolist(), bool(self.antennas[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def sidewalkHeight(self):
+        """
+        The sidewalk height shared by every building in the block.
+        """
+        return self.maxHeight/160.0
+
+    def append(self, spec):
+        """
+        Adds a BuildingSpec to the plan.
+        """
+        self.faceIndices.append(spec.faceIndex)
+        self.heights.append(spec.height)
+        self.levels.append(spec.levels)
+        self.presets.append(PRESET_TYPES.index(spec.presetType))
+        self.antennas.append(int(spec.antenna))
+        self.scales.extend(spec.scales)
+        self.scaleOffsets.append(len(self.scales))
+
+    def _arrays(self):
+        return [self.faceIndices, self.heights, self.levels, self.presets,
+                self.antennas, self.scaleOffsets, self.scales]
+
+    def save(self, filePath):
+        """
+        Writes the plan to filePath.
+        """
+        name = self.blockName.encode('utf-8')
+        header = HEADER_STRUCT.pack(PLAN_MAGIC, self.seed, len(name),
+                self.minHeight, self.maxHeight, self.minLevels,
+                self.maxLevels, self.dropRate, len(self), len(self.scales))
+        with open(filePath, 'wb') as f:
+            f.write(header)
+            f.write(name)
+            for values in self._arrays():
+                if sys.byteorder == 'big':
+                    values = array.array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(f)
+
+
+# Functions
+def load(filePath):
+    """
+    Reads a plan written by BuildingPlan.save().
+    """
+    with open(filePath, 'rb') as f:
+        header = f.read(HEADER_STRUCT.size)
+        if len(header) < HEADER_STRUCT.size or\
+                header[:len(PLAN_MAGIC)] != PLAN_MAGIC:
+            raise CityPlanError("%s is not a plan file" % filePath)
+        (magic, seed, nameLength, minHeight, maxHeight, minLevels, maxLevels,
+                dropRate, buildingCount, scaleCount) =\
+                HEADER_STRUCT.unpack(header)
+        blockName = f.read(nameLength).decode('utf-8')
+        plan = BuildingPlan(blockName, seed, minHeight, maxHeight, minLevels,
+                maxLevels, dropRate)
+        plan.scaleOffsets = array.array('i')
+        counts = [buildingCount]*5 + [buildingCount+1, scaleCount]
+        for values, count in zip(plan._arrays(), counts):
+            values.fromfile(f, count)
+            if sys.byteorder == 'big':
+                values.byteswap()
+    return plan
+
+def planBuilding(rand, faceIndex, height, levels):
+    """
+    Draws the preset type, per level scales and antenna flag of a building
+    from rand, in the same order CityBlock.makeBuilding always has, and
+    returns its BuildingSpec.
+    """
+    presetType = rand.choice(PRESET_TYPES)
+    scales = []
+    for i in range(1, levels):
+        scales.append(0.5+(0.5*rand.random()))
+        scales.append(0.5+(0.5*rand.random()))
+    antenna = levels > 1 and rand.random() > ANTENNA_CHANCE
+    return BuildingSpec(faceIndex, height, levels, presetType, scales,
+            antenna)
+
+def checkParameters(minHeight, maxHeight, minLevels, maxLevels):
+    """
+    Raises a CityPlanError unless buildings can be planned with the given
+    height and level ranges: at least one level, a maxLevels above 
+    minLevels, as levels are drawn from [minLevels, maxLevels), and a 
+    minHeight of at least 0 and no more than maxHeight.
+    """
+    if minLevels < 1:
+        raise CityPlanError("Buildings need at least 1 level, not %s" %
+                minLevels)
+    if maxLevels <= minLevels:
+        raise CityPlanError("maxLevels %s must be greater than minLevels %s"
+                % (maxLevels, minLevels))
+    if minHeight < 0 or maxHeight < minHeight:
+        raise CityPlanError("Heights must be 0 <= minHeight <= maxHeight, not"
+                " %s and %s" % (minHeight, maxHeight))
+
+def planBlock(blockName, faceIndices, seed=cityRandom.SEED, minHeight=1,
+        maxHeight=5, minLevels=1, maxLevels=5, dropRate=0.1, 
+        heightScales=None):
+    """
+    Plans the buildings of a block. Each face spawns a building with
+    probability 1-dropRate, with a height in [minHeight, maxHeight) and a
+    number of levels in [minLevels, maxLevels). Returns a BuildingPlan.
+
+    @param blockName string
+        The name of the block, part of every face's random seed.
+    @param faceIndices list
+        The indices of the faces to plan buildings for.
+    @param heightScales list
+        An optional factor for each face, scaling how far above minHeight
+        its building may rise, e.g. cityDistricts influences. Scaling does
+        not change the values drawn for a face.
+    """
+    checkParameters(minHeight, maxHeight, minLevels, maxLevels)
+    plan = BuildingPlan(blockName, seed, minHeight, maxHeight, minLevels,
+            maxLevels, dropRate)
+    blockSeed = cityRandom.blockSeed(seed, blockName)
+    levelRange = range(minLevels, maxLevels)
+    levelCount = len(levelRange)
+    heightRange = maxHeight-minHeight
+    presetCount = len(PRESET_TYPES)
+
+    # This is planBuilding with the FaceRandom stream inlined, as planning
+    # large blocks is dominated by call overhead. The draws must stay in the
+    # same order.
+    faceSeed = cityRandom.faceSeed
+    modulus = cityRandom.MODULUS
+    multiplier = cityRandom.MULTIPLIER
+    scale = cityRandom.SCALE
+    faces = plan.faceIndices.append
+    heights = plan.heights.append
+    levels = plan.levels.append
+    presets = plan.presets.append
+    antennas = plan.antennas.append
+    scaleOffsets = plan.scaleOffsets.append
+    scales = plan.scales.append
+    scaleCount = 0
+    if heightScales is None:
+        heightScales = [1.0]*len(faceIndices)
+    for faceIndex, heightScale in zip(faceIndices, heightScales):
+        state = faceSeed(blockSeed, faceIndex)*multiplier % modulus
+        if (state-1)*scale < dropRate:
+            continue
+        faces(faceIndex)
+        state = state*multiplier % modulus
+        heights(minHeight + (state-1)*scale*heightRange*heightScale)
+        state = state*multiplier % modulus
+        buildingLevels = levelRange[int((state-1)*scale*levelCount)]
+        levels(buildingLevels)
+        state = state*multiplier % modulus
+        presets(int((state-1)*scale*presetCount))
+        for i in range(2*(buildingLevels-1)):
+            state = state*multiplier % modulus
+            scales(0.5+(0.5*((state-1)*scale)))
+        scaleCount += 2*(buildingLevels-1)
+        scaleOffsets(scaleCount)
+        if buildingLevels > 1:
+            state = state*multiplier % modulus
+            antennas((state-1)*scale > ANTENNA_CHANCE)
+        else:
+            antennas(0)
+    return plan
+
+def quantize(plan, heightSteps=HEIGHT_STEPS):
+    """
+    Groups the buildings of a plan into prototypes sharing the same levels,
+    preset type, antenna flag and height, with heights rounded to one of
+    heightSteps steps between the plan's minHeight and maxHeight. Each
+    prototype takes its scales from the first building in its group and
+    the height at the middle of its step. Returns (prototypes, instances),
+    where prototypes is a BuildingPlan and instances holds, for each
+    building in plan, the index of its prototype.
+    """
+    prototypes = BuildingPlan(plan.blockName, plan.seed, plan.minHeight,
+            plan.maxHeight, plan.minLevels, plan.maxLevels, plan.dropRate)
+    instances = array.array('i')
+    step = float(plan.maxHeight-plan.minHeight)/heightSteps or 1.0
+    keys = {}
+    for i in range(len(plan)):
+        heightStep = min(int((plan.heights[i]-plan.minHeight)/step),
+                heightSteps-1)
+        key = (plan.levels[i], plan.presets[i], plan.antennas[i], heightStep)
+        prototype = keys.get(key)
+        if prototype is None:
+            prototype = len(prototypes)
+            keys[key] = prototype
+            spec = plan[i]
+            prototypes.append(spec._replace(
+                height=plan.minHeight + (heightStep+0.5)*step))
+        instances.append(prototype)
+    return prototypes, instances
+
+def diff(old, new):
+    """
+    Compares two plans for the same block. Returns (removed, changed), where
+    removed holds the face indices of the buildings in old that are not in
+    new or differ from it, and changed is a BuildingPlan of the buildings in
+    new that are not in old or differ from it. Every building differs if the
+    plans' sidewalk heights do.
+    """
+    changed = BuildingPlan(new.blockName, new.seed, new.minHeight,
+            new.maxHeight, new.minLevels, new.maxLevels, new.dropRate)
+    oldRows = {}
+    if old.sidewalkHeight == new.sidewalkHeight:
+        oldRows = dict(zip(old.faceIndices, range(len(old))))
+    kept = set()
+    for i in range(len(new)):
+        faceIndex = new.faceIndices[i]
+        j = oldRows.get(faceIndex)
+        if j is not None and _sameBuilding(old, j, new, i):
+            kept.add(faceIndex)
+        else:
+            changed.append(new[i])
+    removed = array.array('i', [faceIndex for faceIndex in old.faceIndices
+        if faceIndex not in kept])
+    return removed, changed
+
+def _sameBuilding(a, i, b, j):
+    """
+    Returns whether building i of plan a and building j of plan b have the
+    same spec, comparing the plans' columns.
+    """
+    return a.heights[i] == b.heights[j] and a.levels[i] == b.levels[j] and\
+            a.presets[i] == b.presets[j] and\
+            a.antennas[i] == b.antennas[j] and\
+            a.scales[a.scaleOffsets[i]:a.scaleOffsets[i+1]] ==\
+            b.scales[b.scaleOffsets[j]:b.scaleOffsets[j+1]]
+
+
+# Tests
+class TestCityPlan(unittest.TestCase):
+    def setUp(self):
+        self.test_plan = planBlock('testBlock', range(200), minLevels=1,
+                maxLevels=6)
+
+    def test_plan_block(self):
+        """
+        test_plan_block -- ensure the inlined planner matches planBuilding
+        drawing from FaceRandom streams.
+        """
+        blockSeed = cityRandom.blockSeed(cityRandom.SEED, 'testBlock')
+        specs = []
+        for faceIndex in range(200):
+            rand = cityRandom.FaceRandom(blockSeed, faceIndex)
+            if rand.random() < 0.1:
+                continue
+            height = 1 + rand.random()*4
+            levels = rand.choice(range(1, 6))
+            specs.append(planBuilding(rand, faceIndex, height, levels))
+        self.assertEqual(list(self.test_plan), specs)
+
+    def test_check_parameters(self):
+        """
+        test_check_parameters -- ensure level and height ranges that can't
+        be planned are refused.
+        """
+        for minLevels, maxLevels in [(0, 0), (2, 2), (0, 3), (4, 3)]:
+            self.assertRaises(CityPlanError, planBlock, 'testBlock', 
+                    range(10), minLevels=minLevels, maxLevels=maxLevels)
+        self.assertRaises(CityPlanError, planBlock, 'testBlock', range(10),
+                minHeight=5, maxHeight=1)
+        checkParameters(0, 0, 1, 2)
+
+    def test_subset(self):
+        """
+        test_subset -- ensure a face plans the same building regardless of
+        which other faces are planned.
+        """
+        subset = planBlock('testBlock', range(199, 100, -1), minLevels=1,
+                maxLevels=6)
+        specs = dict([(spec.faceIndex, spec) for spec in self.test_plan])
+        for spec in subset:
+            self.assertEqual(spec, specs[spec.faceIndex])
+
+    def test_save_load(self):
+        """
+        test_save_load -- ensure plans survive a round trip through a file.
+        """
+        import os, tempfile
+        handle, filePath = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            self.test_plan.save(filePath)
+            plan = load(filePath)
+        finally:
+            os.remove(filePath)
+        self.assertEqual(list(plan), list(self.test_plan))
+        self.assertEqual(plan.blockName, 'testBlock')
+
+    def test_quantize(self):
+        """
+        test_quantize -- ensure every building maps to a prototype with its
+        levels, preset and antenna, and a height within one step.
+        """
+        plan = planBlock('testBlock', range(20000), minLevels=1, maxLevels=5)
+        prototypes, instances = quantize(plan, 16)
+        self.assertEqual(len(instances), len(plan))
+        self.assertTrue(len(prototypes) <= 4*3*2*16)
+        step = (plan.maxHeight-plan.minHeight)/16.0
+        for spec, prototype in zip(plan, instances):
+            prototype = prototypes[prototype]
+            self.assertEqual(spec.levels, prototype.levels)
+            self.assertEqual(spec.presetType, prototype.presetType)
+            self.assertEqual(spec.antenna, prototype.antenna)
+            self.assertTrue(abs(spec.height-prototype.height) <= step/2.0)
+
+    def test_diff(self):
+        """
+        test_diff -- ensure only buildings that were added or changed are
+        rebuilt, and only those removed or changed are deleted.
+        """
+        removed, changed = diff(self.test_plan, self.test_plan)
+        self.assertEqual((len(removed), len(changed)), (0, 0))
+        plan = planBlock('testBlock', range(100, 300), minLevels=1, 
+                maxLevels=6)
+        removed, changed = diff(self.test_plan, plan)
+        self.assertEqual(removed.tolist(), [f for f in 
+            self.test_plan.faceIndices if f < 100])
+        self.assertEqual(changed.faceIndices.tolist(), [f for f in 
+            plan.faceIndices if f >= 200])
+        levels = planBlock('testBlock', range(200), minLevels=2, maxLevels=6)
+        removed, changed = diff(self.test_plan, levels)
+        self.assertTrue(0 < len(changed) < len(levels))
+        self.assertEqual(sorted(removed), sorted(changed.faceIndices))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,81 @@
+__doc__ = """
+Deterministic random streams for city generation. Every face of a block gets
+its own stream, seeded from (seed, block name, face index), so the values
+drawn for a face do not depend on which other faces were built, in which
+order, or in which process. The streams give the same values under any
+Python version, unlike random.Random.choice.
+"""
+
+# Standard Imports
+import zlib
+
+# Globals
+SEED = 256
+MODULUS = 2147483647
+MULTIPLIER = 48271
+SCALE = 1.0/(MODULUS-1)
+MASK32 = 0xffffffff
+
+# Classes
+class FaceRandom(object):
+    """
+    A small random stream for a single face. Implements the parts of the
+    random.Random interface the city builders use, so it can be passed
+    anywhere the random module is. This is a Lehmer (minstd) generator, which
+    is cheap enough to create one per face.
+    """
+    __slots__ = ('state',)
+
+    def __init__(self, blockSeed, faceIndex):
+        """
+        @param blockSeed int
+            The seed of the block the face belongs to, from blockSeed().
+        @param faceIndex int
+            The index of the face in its mesh.
+        """
+        self.state = faceSeed(blockSeed, faceIndex)
+
+    def random(self):
+        """
+        Returns the next float in [0.0, 1.0).
+        """
+        self.state = self.state*MULTIPLIER % MODULUS
+        return (self.state-1)*SCALE
+
+    def choice(self, seq):
+        """
+        Returns a random element of the non-empty sequence seq.
+        """
+        return seq[int(self.random()*len(seq))]
+
+    def uniform(self, a, b):
+        """
+        Returns a random float between a and b.
+        """
+        return a + (b-a)*self.random()
+
+
+# Functions
+def faceRandom(seed, blockName, faceIndex):
+    """
+    Returns the FaceRandom stream for the face of the named block.
+    """
+    return FaceRandom(blockSeed(seed, blockName), faceIndex)
+
+def blockSeed(seed, blockName):
+    """
+    Returns the 32 bit seed shared by the faces of a block.
+    """
+    return zlib.crc32(('%s:%s' % (seed, blockName)).encode('utf-8')) & MASK32
+
+def faceSeed(blockSeed, faceIndex):
+    """
+    Returns the starting state of the stream for a face, in [1, MODULUS). The
+    block seed and face index are mixed with the murmur3 finalizer so that
+    neighbouring faces get unrelated streams.
+    """
+    h = (blockSeed ^ faceIndex) & MASK32
+    h = ((h ^ (h >> 16))*0x85ebca6b) & MASK32
+    h = ((h ^ (h >> 13))*0xc2b2ae35) & MASK32
+    h ^= h >> 16
+    return h % (MODULUS-1) + 1
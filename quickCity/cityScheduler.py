@@ -0,0 +1,268 @@
+__doc__ = """
+Schedules building a whole city. Blocks are queued on a BuildScheduler and
+planned together first; planning is pure Python, so blocks are planned in
+parallel worker processes. The planned blocks are then built one at a time,
+in the order they were queued, as only one thing may edit the Maya scene at
+once. Building can be cancelled between blocks, and the time each block
+spent planning and building is recorded.
+"""
+
+# Standard Imports
+import multiprocessing, unittest
+from timeit import default_timer
+
+# Non-standard Imports
+import cityDistricts
+
+# Globals
+QUEUED = 'queued'
+PLANNED = 'planned'
+BUILT = 'built'
+CANCELLED = 'cancelled'
+
+# Exceptions
+class CitySchedulerError(Exception):pass
+
+# Classes
+class BuildJob(object):
+    """
+    A block queued on a BuildScheduler, with its plan once it has one, its
+    generated geometry for blocks of the 'geometry' build type, its status
+    and its timings ({'plan': seconds, 'geometry': seconds, 'build': 
+    seconds}).
+    """
+    def __init__(self, block):
+        """
+        @param block quickCity.CityBlock
+            The block to build. Anything with a name, planArguments() and
+            build(plan) will do.
+        """
+        self.block = block
+        self.name = block.name
+        self.plan = None
+        self.geometry = None
+        self.status = QUEUED
+        self.timings = {}
+
+
+class BuildScheduler(object):
+    """
+    Plans and builds a queue of blocks. run() does everything in turn;
+    alternatively prepareJob() may be called for each job from a worker
+    thread, as it never touches the scene, with buildJob() called for each
+    prepared job on the main thread.
+    """
+    def __init__(self, processes=None):
+        """
+        @param processes int
+            The number of worker processes planAll plans with. None uses one
+            per CPU, 1 plans in this process.
+        """
+        self.processes = processes
+        self.jobs = []
+        self.cancelled = False
+
+    def add(self, block):
+        """
+        Queues a block and returns its BuildJob.
+        """
+        job = BuildJob(block)
+        self.jobs.append(job)
+        return job
+
+    def cancel(self):
+        """
+        Stops run() before the next block is built.
+        """
+        self.cancelled = True
+
+    def planAll(self):
+        """
+        Plans every queued job that has no plan yet.
+        """
+        jobs = [job for job in self.jobs if job.plan is None]
+        arguments = [job.block.planArguments() for job in jobs]
+        if self.processes == 1 or len(jobs) < 2:
+            results = [_planJob(a) for a in arguments]
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                results = pool.map(_planJob, arguments)
+            finally:
+                pool.close()
+                pool.join()
+        for job, (plan, seconds) in zip(jobs, results):
+            job.plan = plan
+            job.timings['plan'] = seconds
+            job.status = PLANNED
+
+    def prepareJob(self, job):
+        """
+        Does the part of a job that does not touch the scene, so is safe to
+        call from a worker thread: plans it if it has no plan, and for 
+        blocks of the 'geometry' build type generates their geometry.
+        """
+        if job.plan is None:
+            job.plan, job.timings['plan'] = _planJob(
+                    job.block.planArguments())
+            job.status = PLANNED
+        if getattr(job.block, 'buildType', None) == 'geometry' and\
+                job.geometry is None:
+            start = default_timer()
+            job.geometry = job.block.buildGeometry(job.plan)
+            job.timings['geometry'] = default_timer()-start
+
+    def buildJob(self, job):
+        """
+        Builds a prepared job in the scene. Must be called from the main
+        thread.
+        """
+        start = default_timer()
+        if job.geometry is not None:
+            job.block.createGeometry(job.geometry)
+        else:
+            job.block.build(job.plan)
+        job.timings['build'] = default_timer()-start
+        job.status = BUILT
+
+    def run(self, progress=None):
+        """
+        Plans, then builds every job that has not been built, in queue
+        order. Returns finish().
+
+        @param progress function
+            Called as progress(job, index, count) after each block is built.
+            Returning False cancels the remaining blocks.
+        """
+        self.cancelled = False
+        self.planAll()
+        count = len(self.jobs)
+        for index, job in enumerate(self.jobs):
+            if self.cancelled:
+                break
+            if job.status == BUILT:
+                continue
+            self.prepareJob(job)
+            self.buildJob(job)
+            if progress and progress(job, index, count) is False:
+                self.cancel()
+        return self.finish()
+
+    def finish(self):
+        """
+        Marks the jobs left unbuilt by a cancelled run as cancelled and
+        returns report().
+        """
+        if self.cancelled:
+            for job in self.jobs:
+                if job.status != BUILT:
+                    job.status = CANCELLED
+        return self.report()
+
+    def report(self):
+        """
+        Returns a line per job with its status, building count and timings.
+        """
+        lines = []
+        for job in self.jobs:
+            buildings = 0
+            if job.plan is not None:
+                buildings = len(job.plan)
+            lines.append('%s: %s, %d buildings, plan %.3fs, geometry %.3fs,'
+                    ' build %.3fs' % (job.name, job.status, buildings, 
+                    job.timings.get('plan', 0.0), 
+                    job.timings.get('geometry', 0.0),
+                    job.timings.get('build', 0.0)))
+        return '\n'.join(lines)
+
+
+# Functions
+def _planJob(arguments):
+    """
+    Worker for BuildScheduler.planAll. Plans a block from its
+    planArguments() and returns (plan, seconds).
+    """
+    start = default_timer()
+    plan = cityDistricts.planBlock(*arguments)
+    return plan, default_timer()-start
+
+
+# Tests
+class _TestBlock(object):
+    def __init__(self, name, faceCount):
+        self.name = name
+        self.faceCount = faceCount
+        self.builtPlans = []
+
+    def planArguments(self):
+        return (self.name, list(range(self.faceCount)), [],
+                [(0.0, 0.0, 0.0)])
+
+    def build(self, plan):
+        self.builtPlans.append(plan)
+
+
+class TestCityScheduler(unittest.TestCase):
+    def setUp(self):
+        self.test_blocks = [_TestBlock('block%d' % i, 100*(i+1)) for i in
+                range(3)]
+
+    def test_run(self):
+        """
+        test_run -- ensure blocks are planned in parallel like they are in
+        process, and built once each in queue order.
+        """
+        scheduler = BuildScheduler(processes=2)
+        for block in self.test_blocks:
+            scheduler.add(block)
+        built = []
+        scheduler.run(lambda job, index, count: built.append(job.name))
+        self.assertEqual(built, ['block0', 'block1', 'block2'])
+        for job in scheduler.jobs:
+            self.assertEqual(job.status, BUILT)
+            check = cityDistricts.planBlock(*job.block.planArguments())
+            self.assertEqual(list(job.plan), list(check))
+            self.assertEqual(job.block.builtPlans, [job.plan])
+        scheduler.run()
+        self.assertEqual(len(self.test_blocks[0].builtPlans), 1)
+
+    def test_cancel(self):
+        """
+        test_cancel -- ensure returning False from progress cancels the
+        remaining blocks.
+        """
+        scheduler = BuildScheduler(processes=1)
+        for block in self.test_blocks:
+            scheduler.add(block)
+        scheduler.run(lambda job, index, count: False)
+        self.assertEqual([job.status for job in scheduler.jobs],
+                         [BUILT, CANCELLED, CANCELLED])
+        self.assertTrue('block1: cancelled' in scheduler.report())
+
+    def test_prepare_build(self):
+        """
+        test_prepare_build -- ensure jobs planned and prepared on a worker
+        thread, as quickCityUI's BuildWorker does, build on this one with 
+        the plans the worker made.
+        """
+        import threading
+        scheduler = BuildScheduler(processes=2)
+        for block in self.test_blocks:
+            scheduler.add(block)
+        def prepare():
+            scheduler.planAll()
+            for job in scheduler.jobs:
+                scheduler.prepareJob(job)
+        worker = threading.Thread(target=prepare)
+        worker.start()
+        worker.join()
+        self.assertEqual([job.status for job in scheduler.jobs], 
+                         [PLANNED]*3)
+        for job in scheduler.jobs:
+            scheduler.buildJob(job)
+            self.assertEqual(job.block.builtPlans, [job.plan])
+        self.assertEqual(scheduler.finish().count(BUILT), 3)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
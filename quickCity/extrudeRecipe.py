@@ -0,0 +1,245 @@
+__doc__ = """
+Compiled extrusion recipes. A recipe in the extrudeList vocabulary ('up',
+'down', 'in', 'out', 'antenna') is checked and turned into a tuple of
+ExtrudeOps once, rather than interpreted on every call. Consecutive
+scale-only extrusions are fused into one by multiplying their scales, and
+consecutive translate-only extrusions in the same direction by adding their
+translations, as the rings in between would be flat against their
+neighbours. Each op is run as a single polyExtrudeFacet with its local
+translate and scale given as flags, instead of an extrude followed by
+setAttr calls.
+"""
+
+# Standard Imports
+import array, collections, unittest
+
+# Non-standard Imports
+import cityPlan
+
+# Globals
+HEIGHT_EXTRUDES = ['up', 'down', 'antenna']
+SCALE_EXTRUDES = ['in', 'out']
+ANTENNA_SCALE = 0.5
+
+# The quickCity presets, as (extrudes, heights, scales) for a size of 1.0.
+# Heights are multiplied by the size the preset is applied with.
+RECIPES = {
+    'sidewalk': (['up'], [1.0], []),
+    'rim': (['out', 'up', 'in', 'down', 'in'], [1.0, 0.25],
+            [1.05, 0.95, 0.95]),
+    'well': (['in', 'down', 'in'], [1.0], [0.95, 0.95]),
+    'indent': (['in', 'up'], [1.0], [0.95]),
+    'antenna': (['in', 'antenna'], [1.0], [0.05]),
+}
+
+# Building presets are sized by the level height divided by these.
+PRESET_DIVISORS = {'indent': 10.0, 'rim': 10.0, 'well': 30.0}
+
+# Exceptions
+class RecipeError(Exception):pass
+
+# Classes
+ExtrudeOp = collections.namedtuple('ExtrudeOp', ['translate', 'scaleX',
+    'scaleY'])
+
+
+# Functions
+def compileRecipe(extrudes, heights, scales):
+    """
+    Compiles a recipe into a tuple of fused ExtrudeOps. The height for down
+    is a positive number.
+
+    @param extrudes list
+        A list containing extrude keywords.
+    @param heights list
+        A list of height values corresponding to 'up', 'down' or 'antenna'
+        extrusion keywords.
+    @param scales list
+        A list of scale values corresponding to 'out' and 'in' keywords.
+    """
+    if len(extrudes) != len(heights) + len(scales):
+        raise RecipeError("Expected %d heights and scales for %d extrudes" %
+                (len(heights)+len(scales), len(extrudes)))
+    ops = []
+    heightIndex = 0
+    scaleIndex = 0
+    for e in extrudes:
+        if e in HEIGHT_EXTRUDES:
+            h = heights[heightIndex]
+            if e == 'down':
+                h = -1.0*h
+            if e == 'antenna':
+                ops.append(ExtrudeOp(h, ANTENNA_SCALE, ANTENNA_SCALE))
+            else:
+                ops.append(ExtrudeOp(h, 1.0, 1.0))
+            heightIndex += 1
+        elif e in SCALE_EXTRUDES:
+            s = scales[scaleIndex]
+            ops.append(ExtrudeOp(0.0, s, s))
+            scaleIndex += 1
+        else:
+            raise RecipeError("%s is not a valid extrude type" % e)
+    return fuseOps(ops)
+
+def fuseOps(ops):
+    """
+    Returns ops as a tuple with runs of scale-only ops, and runs of
+    translate-only ops in the same direction, each fused into one op. Ops
+    that do nothing are dropped.
+    """
+    fused = []
+    for op in ops:
+        isScale = op.translate == 0.0
+        isTranslate = op.scaleX == 1.0 and op.scaleY == 1.0
+        if isScale and isTranslate:
+            continue
+        if fused:
+            last = fused[-1]
+            if isScale and last.translate == 0.0:
+                fused[-1] = ExtrudeOp(0.0, last.scaleX*op.scaleX,
+                        last.scaleY*op.scaleY)
+                continue
+            if isTranslate and last.scaleX == 1.0 and last.scaleY == 1.0\
+                    and (op.translate > 0.0) == (last.translate > 0.0):
+                fused[-1] = ExtrudeOp(last.translate+op.translate, 1.0, 1.0)
+                continue
+        fused.append(op)
+    return tuple(fused)
+
+def presetOps(name, size):
+    """
+    Returns the compiled ops of the named preset in RECIPES at the given
+    size.
+    """
+    return [ExtrudeOp(op.translate*size, op.scaleX, op.scaleY) for op in
+            COMPILED[name]]
+
+def buildingOps(spec, sidewalkHeight):
+    """
+    Returns the fused ops for a whole building described by a
+    cityPlan.BuildingSpec: the sidewalk, then for each level an extrude in,
+    an extrude up and the building's preset, with an antenna on the top
+    level. Fusing across the whole building also merges the last scale of a
+    preset with the first scale of the next level.
+    """
+    height = spec.height
+    levels = spec.levels
+    hl = height/levels
+    ops = presetOps('sidewalk', sidewalkHeight)
+    for i in range(1, levels):
+        dHeight = height/(2*i)
+        ops.append(ExtrudeOp(0.0, spec.scales[2*i-2], spec.scales[2*i-1]))
+        ops.append(ExtrudeOp(dHeight, 1.0, 1.0))
+        ops.extend(presetOps(spec.presetType,
+            hl/PRESET_DIVISORS[spec.presetType]))
+        if i == levels-1 and spec.antenna:
+            ops.extend(presetOps('antenna', dHeight/2.0))
+    return fuseOps(ops)
+
+def applyOps(face, ops, commands):
+    """
+    Runs ops on face, one polyExtrudeFacet per op.
+
+    @param face string
+        The face to extrude.
+    @param ops list
+        The ExtrudeOps to apply.
+    @param commands module
+        The module to issue commands to, maya.cmds or a
+        cmdBuffer.CommandBuffer.
+    """
+    for op in ops:
+        flags = {}
+        if op.translate:
+            flags['localTranslateZ'] = op.translate
+        if op.scaleX != 1.0:
+            flags['localScaleX'] = op.scaleX
+        if op.scaleY != 1.0:
+            flags['localScaleY'] = op.scaleY
+        commands.polyExtrudeFacet(face, ch=1, kft=0, **flags)
+
+def buildingTop(levels, height, presetType, sidewalkHeight):
+    """
+    Returns how far the top of a building rises above its face, not counting
+    its antenna. This is the sum of the translations of its buildingOps,
+    found without building them.
+    """
+    top = sidewalkHeight
+    rise = PRESET_RISES[presetType]*(height/levels)/PRESET_DIVISORS[presetType]
+    for i in range(1, levels):
+        top += height/(2*i) + rise
+    return top
+
+def planTops(plan):
+    """
+    Returns an array of the buildingTop of each building in a 
+    cityPlan.BuildingPlan, read straight from the plan's columns.
+    """
+    sidewalkHeight = plan.sidewalkHeight
+    presetTypes = cityPlan.PRESET_TYPES
+    tops = array.array('d')
+    for levels, height, preset in zip(plan.levels, plan.heights, 
+            plan.presets):
+        tops.append(buildingTop(levels, height, presetTypes[preset],
+            sidewalkHeight))
+    return tops
+
+COMPILED = dict([(name, compileRecipe(*RECIPES[name])) for name in RECIPES])
+
+# How far each building preset raises the face, for a size of 1.0.
+PRESET_RISES = dict([(name, sum([op.translate for op in COMPILED[name]])) 
+    for name in PRESET_DIVISORS])
+
+
+# Tests
+class TestExtrudeRecipe(unittest.TestCase):
+    def test_compile(self):
+        """
+        test_compile -- ensure recipes compile to one op per extrude when
+        nothing can be fused.
+        """
+        self.assertEqual(COMPILED['rim'], (ExtrudeOp(0.0, 1.05, 1.05),
+            ExtrudeOp(1.0, 1.0, 1.0), ExtrudeOp(0.0, 0.95, 0.95),
+            ExtrudeOp(-0.25, 1.0, 1.0), ExtrudeOp(0.0, 0.95, 0.95)))
+        self.assertRaises(RecipeError, compileRecipe, ['up', 'in'], [1.0],
+                [])
+        self.assertRaises(RecipeError, compileRecipe, ['sideways'], [1.0],
+                [])
+
+    def test_fuse(self):
+        """
+        test_fuse -- ensure runs of scales and same direction translates are
+        fused, and translates in opposite directions are not.
+        """
+        ops = compileRecipe(['in', 'out', 'up', 'up', 'down', 'antenna'],
+                [1.0, 2.0, 0.5, 1.0], [0.5, 0.5])
+        self.assertEqual(ops, (ExtrudeOp(0.0, 0.25, 0.25),
+            ExtrudeOp(3.0, 1.0, 1.0), ExtrudeOp(-0.5, 1.0, 1.0),
+            ExtrudeOp(1.0, ANTENNA_SCALE, ANTENNA_SCALE)))
+
+    def test_building_ops(self):
+        """
+        test_building_ops -- ensure a preset ending in a scale is fused with
+        the next level's scale.
+        """
+        spec = cityPlan.BuildingSpec(0, 4.0, 3, 'well', [0.5, 0.6, 0.7, 0.8],
+                False)
+        ops = buildingOps(spec, 0.1)
+        self.assertEqual(len(ops), 10)
+        self.assertAlmostEqual(ops[5].scaleX, 0.95*0.7)
+        self.assertAlmostEqual(ops[5].scaleY, 0.95*0.8)
+
+    def test_plan_tops(self):
+        """
+        test_plan_tops -- ensure building tops match the translations of
+        the buildings' ops, less their antennas.
+        """
+        plan = cityPlan.planBlock('testBlock', range(100), maxLevels=6)
+        for spec, top in zip(plan, planTops(plan)):
+            ops = buildingOps(spec._replace(antenna=False), 
+                    plan.sidewalkHeight)
+            self.assertAlmostEqual(top, sum([op.translate for op in ops]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
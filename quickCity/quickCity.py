@@ -1,4 +1,5 @@
 # Standard Imports
+import array
 import random
 import math
 import sys
@@ -6,6 +7,16 @@ import sys
 # Maya Imports
 import maya.cmds as cmds
 
+# Non-standard Imports
+import buildingGeometry
+import cityDistricts
+import cityPlan
+import cityRandom
+import cmdBuffer
+import componentSet
+import extrudeRecipe
+import meshTopology
+
 __doc__ = """
 This is a library for generating random buildings from a plane in maya.
 STUFF OF NOTE:
@@ -17,11 +28,8 @@ faces on.
 
 # Globals
 PROGRESS_WINDOW = False
-ANTENNA_CHANCE = 0.6
 SPAWN_CHANCE = 0.1
-
-# Seed those randoms!
-random.seed(256)
+BUFFER_SIZE = 1000
 
 # Exceptions
 class QuickCityError(Exception):pass
@@ -34,9 +42,20 @@ class CityBlock(object):
     a single plane. Contains methods for creating a single building, and for
     creating multiple buildings from a mesh.
     """
+    __slots__ = ['name', 'buildType', 'seed', 'blockSeed', 'centerFaces',
+            'centerFace', 'sourcePlane', 'targetMesh', 'faceMesh', 
+            'topology', 'faceIndices', 'parentMesh', 'faceMidpoints', 
+            'centerWeights', 'districts', '_faceDistances', 'falloffRadius',
+            'minHeight', 'maxHeight', 'minLevels', 'maxLevels', 'levelRange',
+            'dropRate', 'previewProxy', 'builtPlan', 'buildingGroup',
+            'buildingNodes', 'prototypeGroup', 'prototypeNodes', 
+            'buildingPrototypes', 'originalMesh', 'shader', 'topShader']
+
     def __init__(self, name, sourcePlane=None, targetMesh=None, 
             buildType='mesh', minHeight=1, maxHeight=5, minLevels=1, 
-            maxLevels=5, faceList=[], spawnChance=SPAWN_CHANCE):
+            maxLevels=5, faceList=[], spawnChance=SPAWN_CHANCE,
+            seed=cityRandom.SEED, centerFaces=None, centerWeights=None,
+            falloffRadius=None, shader=None, topShader=None):
         """
         @param name string
             The name of the block. Determines the group name in Maya.
@@ -48,6 +67,12 @@ class CityBlock(object):
         @param targetMesh string
             The 
 
+        @param buildType string
+            How build() creates the buildings, 'mesh' to extrude the faces
+            of the target mesh, 'plane' to extrude duplicates of the source 
+            plane, 'instance' to instance prototypes built on it or
+            'geometry' to generate all of the buildings as one new mesh.
+
         @param minHeight float
             The minimum height of a building.
 
@@ -59,67 +84,338 @@ class CityBlock(object):
 
         @param maxLevels int
             The maximum number of levels a bulding will spawn with.
+
+        @param seed int
+            The seed for the block. Each face draws from its own stream
+            derived from the seed, the block name and the face index.
+
+        @param centerFaces list
+            The faces at the centers of the block's districts. Defaults to
+            the first selected face.
+
+        @param centerWeights list
+            The influence of each district center, 1.0 for each by default.
+
+        @param falloffRadius float
+            If given, building heights fall off with distance from the
+            district centers, reaching minHeight at this distance.
+
+        @param shader string
+            If given, the shader the buildings are assigned once built.
+
+        @param topShader string
+            If given, the shader the top face of each building is assigned.
         """
         self.name = name
-        self.centerFace = cmds.ls(sl=True, fl=True)[0]
+        self.buildType = buildType
+        self.seed = seed
+        self.blockSeed = cityRandom.blockSeed(seed, name)
+        if not centerFaces:
+            faces = getSelectedFaces()
+            centerFaces = ['%s.f[%d]' % (faces.mesh, i) for i in
+                    faces.starts[:1]]
+        self.centerFaces = centerFaces
+        self.centerFace = centerFaces[0]
         self.sourcePlane = sourcePlane
         self.targetMesh = targetMesh
 
-        # Determine which faces to create buildings on.
+        # Determine which faces to create buildings on. Faces are held as
+        # indices into faceMesh; component names are only made to pass to
+        # Maya.
         if not (targetMesh or faceList):
             raise QuickCityError("A targetMesh or faceList must be supplied")
-        if not faceList:
-            faceList = cmds.polyListComponentConversion(targetMesh, tf=True)
-            self.faceList = cmds.ls(faceList, fl=True)
+        if faceList:
+            faces = componentSet.ComponentSet.fromStrings(faceList)
+            self.faceMesh = faces.mesh
+        else:
+            self.faceMesh = targetMesh
+
+        # Everything read from the scene is read here, so that planning and
+        # generating geometry afterwards can run off the main thread. The
+        # topology keeps the face positions as they were at this point, so
+        # anything cached from before the block was made is dropped first.
+        meshTopology.invalidate()
+        self.topology = meshTopology.getTopology(self.faceMesh)
+        if faceList:
+            self.faceIndices = array.array('i', faces)
+        else:
+            self.faceIndices = array.array('i', 
+                    range(self.topology.faceCount))
+        self.parentMesh = getParentMesh(self.faceName(self.faceIndices[0]))
+        self.faceMidpoints = getFaceMidpoints(self.faceMesh, self.faceIndices,
+                True)
+        centerPoints = getFaceListMidpoints(centerFaces, True)
+        self.centerWeights = centerWeights
+        self.districts = cityDistricts.DistrictField([centerPoints[i:i+3] for
+            i in range(0, len(centerPoints), 3)], centerWeights)
+        self._faceDistances = None
+        self.falloffRadius = falloffRadius
+        self.setParameters(minHeight, maxHeight, minLevels, maxLevels)
+        self.dropRate = SPAWN_CHANCE
+        self.previewProxy = None
+
+        # What the last build produced: its plan, the group or mesh holding
+        # the buildings, the node of each building by face index, and for
+        # instance blocks the prototype node of each prototype spec and the
+        # prototype node each building instances, by face index. Mesh blocks
+        # keep a hidden copy of the target mesh as it was before extruding.
+        self.builtPlan = None
+        self.buildingGroup = None
+        self.buildingNodes = {}
+        self.prototypeGroup = None
+        self.prototypeNodes = {}
+        self.buildingPrototypes = {}
+        self.originalMesh = None
+        self.shader = shader
+        self.topShader = topShader
 
-        self.parentMesh = getParentMesh(self.faceList[0])
-        self.faceDistances = getFaceDistances(self.centerFace, self.faceList)
-        self.maxDistance = max(self.faceDistances.values())
+    @property
+    def faceDistances(self):
+        """
+        An array of the distance from each face to its nearest district 
+        center, in the order of faceIndices, computed the first time it is
+        asked for.
+        """
+        if self._faceDistances is None:
+            self._faceDistances = self.districts.distances(self.faceMidpoints)
+        return self._faceDistances
+
+    @property
+    def maxDistance(self):
+        return max(self.faceDistances)
+
+    def faceRandom(self, faceIndex):
+        """
+        Returns the random stream for the face of this block with the given
+        index.
+        """
+        return cityRandom.FaceRandom(self.blockSeed, faceIndex)
+
+    def faceName(self, faceIndex):
+        """
+        Returns the component name of the face of the block with the given
+        index.
+        """
+        return '%s.f[%d]' % (self.faceMesh, faceIndex)
+
+    def plan(self):
+        """
+        Plans the buildings for this block without touching the scene. If
+        the block has a falloffRadius, heights are scaled by the influence
+        of the district centers at each face. Returns a 
+        cityPlan.BuildingPlan which can be saved, and passed to build, 
+        buildMesh or buildPlanes.
+        """
+        return cityDistricts.planBlock(*self.planArguments())
+
+    def planArguments(self):
+        """
+        Returns the arguments cityDistricts.planBlock plans this block with,
+        as plain data that can be sent to a worker process.
+        """
+        return (self.name, self.faceIndices, self.faceMidpoints,
+                self.districts.centers, self.centerWeights, 
+                self.falloffRadius, self.seed, self.minHeight, 
+                self.maxHeight, self.minLevels, self.maxLevels, 
+                self.dropRate)
+
+    def setParameters(self, minHeight, maxHeight, minLevels, maxLevels):
+        """
+        Changes the height and level ranges the block is planned with. 
+        Raises a QuickCityError, leaving the block as it was, if buildings
+        can't be planned with them.
+        """
+        try:
+            cityPlan.checkParameters(minHeight, maxHeight, minLevels, 
+                    maxLevels)
+        except cityPlan.CityPlanError as e:
+            raise QuickCityError("%s: %s" % (self.name, e))
         self.minHeight = minHeight
         self.maxHeight = maxHeight
+        self.minLevels = minLevels
+        self.maxLevels = maxLevels
         self.levelRange = range(minLevels, maxLevels)
-        self.dropRate = SPAWN_CHANCE
+
+    def preview(self, plan=None):
+        """
+        Shows the planned buildings as boxes in a single preview mesh, 
+        updated in place each time this is called, rather than building
+        them. Returns the plan shown.
+
+        @param plan cityPlan.BuildingPlan
+            The buildings to show. A new plan is made if none is given.
+        """
+        if plan is None:
+            plan = self.plan()
+        if self.previewProxy is None:
+            self.previewProxy = buildingGeometry.BoxProxy(self.name + 
+                    "_preview")
+        self.previewProxy.update(plan, self.topology)
+        return plan
+
+    def clearPreview(self):
+        """
+        Deletes the preview mesh, if there is one.
+        """
+        if self.previewProxy is not None:
+            self.previewProxy.delete()
+            self.previewProxy = None
+
+    def build(self, plan=None):
+        """
+        Builds the block as its buildType says, with a progress window for
+        the build types that extrude.
+
+        @param plan cityPlan.BuildingPlan
+            The buildings to create. A new plan is made if none is given.
+        """
+        if plan is None:
+            plan = self.plan()
+        meshTopology.invalidate(self.faceMesh)
+        self.clearPreview()
+        if self.buildType == 'geometry':
+            self.createGeometry(self.buildGeometry(plan))
+            self.builtPlan = plan
+            return
+        builders = {'mesh': self.buildMesh, 'plane': self.buildPlanes,
+                'instance': self.buildInstances}
+        if self.buildType not in builders:
+            raise QuickCityError("%s is not a valid build type" % 
+                    self.buildType)
+        initializeProgressWindow("Building " + self.name, len(plan))
+        builders[self.buildType](plan)
+        self.builtPlan = plan
+
+    def rebuild(self, plan=None):
+        """
+        Brings a built block up to date with a new plan, usually after its
+        parameters have changed. For plane and instance blocks only the
+        buildings whose spec changed are deleted and built again; the 
+        others are left in place. Prototypes no building instances any
+        more are deleted. Geometry and mesh blocks are one mesh, so they 
+        are generated again as a whole. Blocks that have not been built are
+        built.
+
+        @param plan cityPlan.BuildingPlan
+            The buildings the block should have. A new plan is made if none
+            is given.
+        """
+        if plan is None:
+            plan = self.plan()
+        meshTopology.invalidate(self.faceMesh)
+        if self.buildType in ('geometry', 'mesh'):
+            self.deleteBuildings()
+            self.build(plan)
+            return
+        if self.builtPlan is None:
+            self.build(plan)
+            return
+
+        removed, changed = cityPlan.diff(self.builtPlan, plan)
+        # Buildings missing from a cancelled build are built too.
+        missing = set(plan.faceIndices).difference(self.buildingNodes)
+        missing.difference_update(changed.faceIndices)
+        for spec in plan:
+            if spec.faceIndex in missing:
+                changed.append(spec)
+        if len(changed) == len(plan):
+            self.deleteBuildings()
+            self.build(plan)
+            return
+
+        nodes = [self.buildingNodes.pop(faceIndex) for faceIndex in removed 
+                if faceIndex in self.buildingNodes]
+        for faceIndex in removed:
+            self.buildingPrototypes.pop(faceIndex, None)
+        if nodes:
+            cmds.delete(nodes)
+        self.clearPreview()
+        if len(changed):
+            initializeProgressWindow("Rebuilding " + self.name, len(changed))
+            if self.buildType == 'plane':
+                self.buildPlanes(changed)
+            else:
+                self.buildInstances(changed)
+        self.deleteUnusedPrototypes()
+        self.builtPlan = plan
+
+    def deleteUnusedPrototypes(self):
+        """
+        Deletes the prototypes that none of the block's buildings instance.
+        """
+        used = set(self.buildingPrototypes.values())
+        unused = [key for key, node in self.prototypeNodes.items() if
+                node not in used]
+        nodes = [self.prototypeNodes.pop(key) for key in unused]
+        nodes = [node for node in nodes if cmds.objExists(node)]
+        if nodes:
+            cmds.delete(nodes)
+
+    def deleteBuildings(self):
+        """
+        Deletes everything the last build of the block created. The target
+        mesh of a mesh block is put back as it was before it was extruded.
+        """
+        nodes = [node for node in [self.buildingGroup, self.prototypeGroup]
+                if node is not None and cmds.objExists(node)]
+        if nodes:
+            cmds.delete(nodes)
+        if self.originalMesh is not None and self.builtPlan is not None:
+            cmds.delete(self.faceMesh)
+            restored = cmds.duplicate(self.originalMesh, name=self.faceMesh)
+            cmds.showHidden(restored)
+            meshTopology.invalidate(self.faceMesh)
+        self.builtPlan = None
+        self.buildingGroup = None
+        self.buildingNodes = {}
+        self.prototypeGroup = None
+        self.prototypeNodes = {}
+        self.buildingPrototypes = {}
 
     # Extrude Presets
     def getFaces(self):
         """
-        Returns a list of currently selected faces.
+        Returns the currently selected faces as a componentSet.ComponentSet.
         """
-        faces = cmds.ls(sl=True, fl=True)
-        return faces
+        return getSelectedFaces()
 
-    def makeSidewalk(self, face, walkHeight):
+    def makeSidewalk(self, face, walkHeight, commands=cmds):
         """
         Creates a sidewalk from the given face of height walkHeight.
         """
-        extrudeList(face, ['up'], [walkHeight], [])
+        extrudeRecipe.applyOps(face, 
+                extrudeRecipe.presetOps('sidewalk', walkHeight), commands)
 
-    def makeRim(self, face, rimHeight):
+    def makeRim(self, face, rimHeight, commands=cmds):
         """
         Creates a building rim on face of height rimHeight
         """
-        extrudeList(face, ['out', 'up', 'in', 'down', 'in'], 
-                [rimHeight, rimHeight*0.25], [1.05, 0.95, 0.95])
+        extrudeRecipe.applyOps(face, 
+                extrudeRecipe.presetOps('rim', rimHeight), commands)
 
-    def makeWell(self, face, wellDepth):
+    def makeWell(self, face, wellDepth, commands=cmds):
         """
         Creates a building well on face of depth wellDepth
         """
-        extrudeList(face, ['in', 'down', 'in'], [wellDepth], [0.95, 0.95])
+        extrudeRecipe.applyOps(face, 
+                extrudeRecipe.presetOps('well', wellDepth), commands)
 
-    def makeIndent(self, face, indentDepth):
+    def makeIndent(self, face, indentDepth, commands=cmds):
         """
         Creates an indent in face of depth indentDepth.
         """
-        extrudeList(face, ['in','up'], [indentDepth], [0.95])
+        extrudeRecipe.applyOps(face, 
+                extrudeRecipe.presetOps('indent', indentDepth), commands)
 
-    def makeAntenna(self, face, antennaHeight):
+    def makeAntenna(self, face, antennaHeight, commands=cmds):
         """
         Creates an antenna on face of height antennaHeight.
         """
-        extrudeList(face, ['in', 'antenna'], [antennaHeight], [0.05])
+        extrudeRecipe.applyOps(face, 
+                extrudeRecipe.presetOps('antenna', antennaHeight), commands)
 
-    def makeBuilding(self, face, levels, height, sidewalkHeight):
+    def makeBuilding(self, face, levels, height, sidewalkHeight, 
+            commands=cmds, rand=random):
         """
         Creates a building frm a supplied polygon face.
 
@@ -131,86 +427,377 @@ class CityBlock(object):
             The total height of the building.
         @param sidewalkHeight float
             The height of the sidewalk.
+        @param commands module
+            The module to issue commands to, maya.cmds or a 
+            cmdBuffer.CommandBuffer.
+        @param rand module
+            The random stream to draw from, the random module or a 
+            cityRandom.FaceRandom.
         """
-        hl = height/levels
-        presetType = random.choice(['indent', 'rim','well'])
-        self.makeSidewalk(face, sidewalkHeight)
-        for i in range(1, levels):
-            dHeight = height/(2*i)
+        spec = cityPlan.planBuilding(rand, None, height, levels)
+        self.buildFromSpec(face, spec, sidewalkHeight, commands)
 
-            # Extrude in.
-            extrude1 = cmds.polyExtrudeFacet(face, ch=1, kft=0)[0]
-            cmds.setAttr(extrude1+".localScaleX", 0.5+(0.5*random.random())); 
-            cmds.setAttr(extrude1+".localScaleY", 0.5+(0.5*random.random()));
+    def buildFromSpec(self, face, spec, sidewalkHeight, commands=cmds):
+        """
+        Creates the building described by a cityPlan.BuildingSpec from a
+        supplied polygon face.
 
-            # Extrude again and translate up.
-            extrude2 = cmds.polyExtrudeFacet(face, ch=1, kft=0)[0]
-            cmds.setAttr(extrude2+".localTranslateZ",  dHeight)
+        @param face string
+            The face from which to create the building.
+        @param spec cityPlan.BuildingSpec
+            The building to create.
+        @param sidewalkHeight float
+            The height of the sidewalk.
+        @param commands module
+            The module to issue commands to, maya.cmds or a 
+            cmdBuffer.CommandBuffer.
+        """
+        ops = extrudeRecipe.buildingOps(spec, sidewalkHeight)
+        extrudeRecipe.applyOps(face, ops, commands)
 
-            # Add a preset.
-            if presetType == 'indent':
-                self.makeIndent(face, hl/10.0)
-            if presetType == 'rim':
-                self.makeRim(face, hl/10.0)
-            if presetType == 'well':
-                self.makeWell(face, hl/30.0)
+    def buildMesh(self, plan=None):
+        """
+        Creates buildings on selected faces with probability 1-dropRate.
+        Commands are buffered and flushed every BUFFER_SIZE commands. A
+        hidden copy of the target mesh is kept first, so that 
+        deleteBuildings can put it back for a rebuild.
 
-            # If we're at the top level, add an antenna.
-            if(i == levels-1 and random.random() > ANTENNA_CHANCE):
-                self.makeAntenna(face, dHeight/2.0)
+        @param plan cityPlan.BuildingPlan
+            The buildings to create, from plan() or cityPlan.load(). A new
+            plan is made if none is given.
+        """
+        if plan is None:
+            plan = self.plan()
+        if self.originalMesh is None:
+            self.originalMesh = cmds.duplicate(self.faceMesh, 
+                    name=self.name + "_original")[0]
+            cmds.hide(self.originalMesh)
+        faceCount = cmds.polyEvaluate(self.faceMesh, f=True)
+        commandBuffer = cmdBuffer.CommandBuffer()
+        built = 0
+        for i, spec in enumerate(plan):
+            self.buildFromSpec(self.faceName(spec.faceIndex), spec,
+                    plan.sidewalkHeight, commandBuffer)
+            built = i+1
+            if len(commandBuffer) >= BUFFER_SIZE:
+                commandBuffer.flush()
+            if not updateProgressWindow(i, len(plan)):
+                break
+            commandBuffer.delete(self.parentMesh, constructionHistory=True)
+        commandBuffer.flush()
+        meshTopology.invalidate(self.faceMesh)
+        # Extruded faces keep their index as the top of the building, and
+        # the faces the extrusions add are numbered after the mesh's own, so
+        # the rest of the target mesh keeps its shading.
+        tops = plan.faceIndices[:built]
+        faceRanges = [(self.faceMesh, f, f) for f in tops]
+        newFaceCount = cmds.polyEvaluate(self.faceMesh, f=True)
+        if newFaceCount > faceCount:
+            faceRanges.append((self.faceMesh, faceCount, newFaceCount-1))
+        self.shadeBuildings([], [(self.faceMesh, tops)], 
+                faceRanges=faceRanges)
+        killProgressWindow()
 
-    def buildMesh(self):
+    def buildPlanes(self, plan=None):
         """
-        Creates buildings on selected faces with probability 1-dropRate.
+        Creates buildings on new planes with probability of 1-SPAWN_CHANCE.
+        Commands are buffered and flushed every BUFFER_SIZE commands. The
+        buildings are added to the block's group if it already has one.
+
+        @param plan cityPlan.BuildingPlan
+            The buildings to create, from plan() or cityPlan.load(). A new
+            plan is made if none is given.
         """
-        sidewalkHeight = self.maxHeight/160.0
-        i = 0
-        for f in self.faceList:
-            if random.random() >= self.dropRate:
-                height = self.minHeight +\
-                         random.random()*(self.maxHeight-self.minHeight)
-                levels = random.choice(self.levelRange)
-                self.makeBuilding(f, levels, height, sidewalkHeight)
-            if not updateProgressWindow(i, len(self.faceList)):
+        if plan is None:
+            plan = self.plan()
+        buildings = []
+        commandBuffer = cmdBuffer.CommandBuffer()
+        midpoints = getFaceMidpoints(self.faceMesh, plan.faceIndices, True)
+        for i, spec in enumerate(plan):
+            #get the midpoint of the current face
+            midpoint = midpoints[3*i:3*i+3].tolist()
+
+            #make a duplicate of the parent plane
+            dupName = self.name + "building_"+str(spec.faceIndex)
+            dupFace = dupName + ".f[0]"
+            commandBuffer.duplicate(self.sourcePlane, name=dupName)
+            commandBuffer.xform(dupName, t=midpoint)
+
+            #create building and add it to building list
+            self.buildFromSpec(dupFace, spec, plan.sidewalkHeight, 
+                    commandBuffer)
+            buildings += [dupName]
+            self.buildingNodes[spec.faceIndex] = dupName
+            if len(commandBuffer) >= BUFFER_SIZE:
+                commandBuffer.flush()
+            if(not updateProgressWindow(i, len(plan))):
                 break
-            i += 1
-            cmds.delete(self.parentMesh, constructionHistory=True)
+        commandBuffer.flush()
+        self.groupBuildings(buildings)
+        self.shadeBuildings(buildings, [(b, [0]) for b in buildings])
         killProgressWindow()
 
-    def buildPlanes(self):
+    def buildInstances(self, plan=None, heightSteps=cityPlan.HEIGHT_STEPS):
         """
-        Creates buildings on new planes with probability of 1-SPAWN_CHANCE
+        Like buildPlanes, but the planned buildings are first quantized into
+        prototypes with cityPlan.quantize. Each prototype is built once on a
+        duplicate of the source plane, and every building is placed as an
+        instance of its prototype, so the block holds a few hundred unique
+        meshes rather than one per building. The prototypes are grouped and
+        hidden. Prototypes the block already has are reused, and the 
+        buildings are added to the block's group if it already has one.
+        Commands are buffered and flushed every BUFFER_SIZE commands.
+
+        @param plan cityPlan.BuildingPlan
+            The buildings to create, from plan() or cityPlan.load(). A new
+            plan is made if none is given.
+        @param heightSteps int
+            The number of heights buildings are rounded to.
         """
+        if plan is None:
+            plan = self.plan()
+        prototypes, instances = cityPlan.quantize(plan, heightSteps)
+        commandBuffer = cmdBuffer.CommandBuffer()
+
+        # Build each prototype once, at the source plane. Prototype specs
+        # take their heights from the middle of a height step, so equal 
+        # specs from different builds are the same prototype.
+        prototypeNames = []
+        newPrototypes = []
+        usedNames = set(self.prototypeNodes.values())
+        for spec in prototypes:
+            key = (spec.levels, spec.presetType, spec.antenna, spec.height)
+            prototypeName = self.prototypeNodes.get(key)
+            if prototypeName is None:
+                count = len(self.prototypeNodes)
+                prototypeName = self.name + "_prototype_" + str(count)
+                # Unused prototypes are deleted by rebuild(), so the count
+                # may name one that is still in use.
+                while prototypeName in usedNames:
+                    count += 1
+                    prototypeName = self.name + "_prototype_" + str(count)
+                usedNames.add(prototypeName)
+                commandBuffer.duplicate(self.sourcePlane, name=prototypeName)
+                self.buildFromSpec(prototypeName + ".f[0]", spec, 
+                        plan.sidewalkHeight, commandBuffer)
+                self.prototypeNodes[key] = prototypeName
+                newPrototypes += [prototypeName]
+            prototypeNames += [prototypeName]
+            if len(commandBuffer) >= BUFFER_SIZE:
+                commandBuffer.flush()
+        prototypeGroup = None
+        if newPrototypes and self.prototypeGroup is None:
+            prototypeGroup = commandBuffer.group(newPrototypes, 
+                    name=self.name + "_prototypes")
+            commandBuffer.hide(prototypeGroup)
+        elif newPrototypes:
+            commandBuffer.parent(newPrototypes, self.prototypeGroup)
+        # Shader membership is per instance path, so prototypes are shaded
+        # before they are instanced, which gives the instances their shaders.
+        self.shadeBuildings(newPrototypes, [(p, [0]) for p in newPrototypes],
+                commandBuffer)
+
+        # Place an instance of its prototype at each face.
         buildings = []
-        i = 0
-        sidewalkHeight = self.maxHeight/160.0
-        for f in self.faceList:
-            if(random.random() >= self.dropRate):
-                height = self.minHeight +\
-                         random.random()*(self.maxHeight-self.minHeight)
-                levels = random.choice(self.levelRange)
-
-                #get the midpoint of the current face
-                verts = makeVertList(cmds.xform(f, q=True, t=True))
-                midpoint = getMidpoint(verts, True)
-
-                #make a duplicate of the parent plane
-                dupName = self.name + "building_"+str(i)
-                dupFace = dupName + ".f[0]"
-                cmds.duplicate(self.sourcePlane, name=dupName)
-                cmds.xform(t=midpoint)
-
-                #create building and add it to building list
-                self.makeBuilding(dupFace, levels, height, sidewalkHeight)
-                buildings += [dupName]
-                i += 1
-            if(not updateProgressWindow(i, len(self.faceList))):
+        midpoints = getFaceMidpoints(self.faceMesh, plan.faceIndices, True)
+        for i, prototype in enumerate(instances):
+            midpoint = midpoints[3*i:3*i+3].tolist()
+            faceIndex = plan.faceIndices[i]
+            instanceName = self.name + "building_" + str(faceIndex)
+            commandBuffer.instance(prototypeNames[prototype], 
+                    name=instanceName)
+            commandBuffer.xform(instanceName, t=midpoint)
+            buildings += [instanceName]
+            self.buildingNodes[faceIndex] = instanceName
+            self.buildingPrototypes[faceIndex] = prototypeNames[prototype]
+            if len(commandBuffer) >= BUFFER_SIZE:
+                commandBuffer.flush()
+            if(not updateProgressWindow(i, len(plan))):
                 break
-        cmds.group(buildings, name=self.name + "_buildings")
+        commandBuffer.flush()
+        if prototypeGroup is not None:
+            self.prototypeGroup = prototypeGroup.resolve()
+        self.groupBuildings(buildings)
         killProgressWindow()
 
+    def groupBuildings(self, buildings):
+        """
+        Puts new building nodes in the block's group, creating the group if
+        the block has none.
+        """
+        if not buildings:
+            return
+        if self.buildingGroup is None or not cmds.objExists(
+                self.buildingGroup):
+            self.buildingGroup = cmds.group(buildings, 
+                    name=self.name + "_buildings")
+        else:
+            cmds.parent(buildings, self.buildingGroup)
+
+    def shadeBuildings(self, objects, topFaces, commands=cmds, 
+            faceRanges=()):
+        """
+        Assigns the block's shader to every face of objects and to the 
+        faceRanges, then its topShader to the top faces, with a ShaderBatch
+        so each shader takes a single sets call. Does nothing for a block 
+        without shaders.
+
+        @param objects list
+            The nodes holding the new buildings.
+        @param topFaces list
+            (mesh, face indices) pairs of the buildings' top faces.
+        @param commands module
+            The module to issue the sets calls to, maya.cmds or a 
+            cmdBuffer.CommandBuffer.
+        @param faceRanges list
+            (mesh, start, end) inclusive ranges of building faces on meshes
+            that also hold other faces.
+        """
+        if not (self.shader or self.topShader):
+            return
+        batch = ShaderBatch()
+        if self.shader:
+            for node in objects:
+                batch.addObject(node, self.shader)
+            for mesh, start, end in faceRanges:
+                batch.addFaceRange(mesh, start, end, self.shader)
+        if self.topShader:
+            for mesh, faceIndices in topFaces:
+                batch.addFaces(mesh, faceIndices, self.topShader)
+        batch.assign(commands)
+
+    def buildGeometry(self, plan=None, mesh=None):
+        """
+        Generates the planned buildings directly into a 
+        buildingGeometry.MeshBuffer, without any extrusion commands or 
+        history. The buildings are in the object space of the target mesh. 
+        Create the buffer with createGeometry(), or write it out with its
+        writeObj(). This does not touch the scene, so may run on a worker
+        thread.
+
+        @param plan cityPlan.BuildingPlan
+            The buildings to create, from plan() or cityPlan.load(). A new
+            plan is made if none is given.
+        @param mesh buildingGeometry.MeshBuffer
+            The buffer to append the buildings to. A new buffer is made if
+            none is given, so several blocks can share one mesh.
+        """
+        if plan is None:
+            plan = self.plan()
+        if mesh is None:
+            mesh = buildingGeometry.MeshBuffer()
+        for spec in plan:
+            positions = self.topology.facePositions(spec.faceIndex)
+            buildingGeometry.addBuilding(mesh, positions, spec, 
+                    plan.sidewalkHeight)
+        return mesh
+
+    def exportObj(self, filePath, plan=None,
+            chunkSize=buildingGeometry.CHUNK_SIZE):
+        """
+        Streams the planned buildings straight to an OBJ file with
+        buildingGeometry.streamBuildings, chunkSize buildings at a time, 
+        without creating anything in the scene. Returns (count, rate), the
+        number of buildings written and the throughput in buildings per 
+        second.
+
+        @param plan cityPlan.BuildingPlan
+            The buildings to export. A new plan is made if none is given.
+        """
+        if plan is None:
+            plan = self.plan()
+        with buildingGeometry.ObjWriter(filePath) as writer:
+            count, seconds = buildingGeometry.streamBuildings(plan,
+                    self.topology.facePositions, writer, chunkSize)
+        return count, count/max(seconds, 1e-9)
+
+    def createGeometry(self, mesh):
+        """
+        Creates a buildingGeometry.MeshBuffer from buildGeometry in the 
+        scene as the block's buildings, and returns its name.
+        """
+        self.clearPreview()
+        self.buildingGroup = mesh.create(self.name + "_buildings")
+        self.shadeBuildings([self.buildingGroup], [(self.buildingGroup,
+            [end-1 for end in mesh.shellEnds])])
+        return self.buildingGroup
+
+
+class ShaderBatch(object):
+    """
+    Collects the objects and faces to assign to each shader while buildings
+    are generated, then assigns them with one sets call per shading group.
+    Faces are merged into a componentSet.ComponentSet per mesh and passed as
+    compact ranges, so shading a whole city takes a call per shader rather
+    than one per face. Shaders are assigned in the order they were first
+    added to, so faces added to a later shader override objects added to an
+    earlier one.
+    """
+    def __init__(self):
+        self.shadingGroups = []
+        self.objects = {}
+        self.faces = {}
+
+    def _members(self, shader):
+        shadingGroup = shader + "SG"
+        if shadingGroup not in self.objects:
+            self.shadingGroups.append(shadingGroup)
+            self.objects[shadingGroup] = []
+            self.faces[shadingGroup] = {}
+        return shadingGroup
+
+    def addObject(self, node, shader):
+        """
+        Adds every face of node to shader.
+        """
+        self.objects[self._members(shader)].append(node)
+
+    def addFaces(self, mesh, faceIndices, shader):
+        """
+        Adds the faces of mesh with the given indices to shader.
+        """
+        faces = self.faces[self._members(shader)]
+        faces.setdefault(mesh, []).extend([(i, i) for i in faceIndices])
+
+    def addFaceRange(self, mesh, start, end, shader):
+        """
+        Adds the faces of mesh from start to end inclusive to shader.
+        """
+        faces = self.faces[self._members(shader)]
+        faces.setdefault(mesh, []).append((start, end))
+
+    def assign(self, commands=cmds):
+        """
+        Assigns everything collected, one sets call per shading group, and
+        empties the batch. Returns the number of calls made.
+        """
+        calls = 0
+        for shadingGroup in self.shadingGroups:
+            members = list(self.objects[shadingGroup])
+            for mesh, intervals in sorted(self.faces[shadingGroup].items()):
+                members.extend(componentSet.ComponentSet(mesh, 'f', 
+                    intervals).names())
+            if members:
+                commands.sets(members, e=True, forceElement=shadingGroup)
+                calls += 1
+        self.__init__()
+        return calls
+
 
 # Functions
+def getSelectedFaces():
+    """
+    Returns the selected faces of the first mesh with selected faces as a
+    componentSet.ComponentSet, without flattening the selection. The set is
+    empty if no faces are selected.
+    """
+    faces = [c for c in cmds.ls(sl=True) or [] if '.f[' in c]
+    if not faces:
+        return componentSet.ComponentSet(None, 'f')
+    mesh = faces[0].split('.f[')[0]
+    return componentSet.ComponentSet.fromStrings([f for f in faces if 
+        f.split('.f[')[0] == mesh])
+
 def getParentMesh(face):
     """
     Returns the parent mesh of the face.
@@ -270,19 +857,88 @@ def distBetween(v1, v2, useSquareDistance=False):
     else:
         return math.sqrt(squareDist)
 
-def getFaceDistances(centerFace, otherFaces):
+def getFaceListMidpoints(faces, useMinZ=False):
+    """
+    Returns the midpoints of the named faces, which may belong to different
+    meshes, as a flat [x0, y0, z0, x1, ...] array in the order given. See
+    getFaceMidpoints.
+    """
+    meshFaces = {}
+    for i, f in enumerate(faces):
+        mesh, componentType, index = meshTopology.splitComponent(f)
+        order, indices = meshFaces.setdefault(mesh, ([], []))
+        order.append(i)
+        indices.append(index)
+    midpoints = array.array('d', [0.0])*(3*len(faces))
+    for mesh, (order, indices) in meshFaces.items():
+        meshMidpoints = getFaceMidpoints(mesh, indices, useMinZ)
+        for j, i in enumerate(order):
+            midpoints[3*i:3*i+3] = meshMidpoints[3*j:3*j+3]
+    return midpoints
+
+def getFaceMidpoints(mesh, faceIndices, useMinZ=False):
+    """
+    Returns the midpoints of the faces of mesh with the given indices, as a
+    flat [x0, y0, z0, x1, ...] array. Each midpoint is what getMidpoint 
+    gives for the face's vertices, but all of them are found in one pass 
+    over the mesh topology cache.
+
+    @param mesh string
+        The mesh the faces belong to.
+    @param faceIndices list
+        The indices of the faces.
+    @param useMinZ bool
+        If True the minimum z value of each face is used rather than the
+        midpoint z value.
+    """
+    topology = meshTopology.getTopology(mesh)
+    positions = topology.positions()
+    faceVertices, faceOffsets = topology.faceVertices()
+    midpoints = array.array('d')
+    for f in faceIndices:
+        start = faceOffsets[f]
+        v = 3*faceVertices[start]
+        minX = maxX = positions[v]
+        minY = maxY = positions[v+1]
+        minZ = maxZ = positions[v+2]
+        for v in faceVertices[start+1:faceOffsets[f+1]]:
+            x = positions[3*v]; y = positions[3*v+1]; z = positions[3*v+2]
+            if x < minX: minX = x
+            elif x > maxX: maxX = x
+            if y < minY: minY = y
+            elif y > maxY: maxY = y
+            if z < minZ: minZ = z
+            elif z > maxZ: maxZ = z
+        if not useMinZ:
+            minZ = (minZ + maxZ)/2.0
+        midpoints.extend(((maxX + minX)/2.0, (maxY + minY)/2.0, minZ))
+    return midpoints
+
+def duplicateFace(face, name=None):
     """
-    Gets the distance between the centerFace and each of the faces in the
-    otherFaces list.
+    Returns a new mesh holding a copy of a single face, moved so that the
+    face's midpoint is at the origin, to use as the source plane of a block.
+    The face's own mesh is left as it is.
+
+    @param face string
+        The face to copy, e.g. 'pPlane1.f[0]'.
+    @param name string
+        The name of the new mesh, if given.
     """
-    distDict = {}
-    centerPoint = getMidpoint(makeVertList(cmds.xform(centerFace, 
-        q=True, t=True)), True)
-    for f in otherFaces:
-        faceMidpoint = getMidpoint(makeVertList(cmds.xform(f, 
-            q=True, t=True)), True)
-        distDict[f] = distBetween(faceMidpoint, centerPoint, False)
-    return distDict
+    mesh, componentType, index = meshTopology.splitComponent(face)
+    if name:
+        plane = cmds.duplicate(mesh, name=name)[0]
+    else:
+        plane = cmds.duplicate(mesh)[0]
+    faceCount = cmds.polyEvaluate(plane, f=True)
+    others = componentSet.ComponentSet(plane, 'f', [(start, end) for
+        start, end in [(0, index-1), (index+1, faceCount-1)] if
+        start <= end])
+    if len(others):
+        cmds.delete(others.names())
+    x, y, z = getFaceMidpoints(mesh, [index], True)
+    cmds.move(-x, -y, -z, plane + '.vtx[*]', relative=True, objectSpace=True)
+    return plane
 
 def makeVertList(numList):
     """
@@ -317,21 +973,26 @@ def addShader(face, shader):
     faces = selection[0]
     cmds.sets(faces, e=True, forceElement=shader+"SG")
 
-def addShaderTop(face, shader):
+def addShaderTop(face, shader, batch=None):
     """
-    Add a shader to the top of a face
+    Add a shader to the top of a face. If a ShaderBatch is given, the face is
+    added to it to be assigned with the rest of the batch instead.
     """
+    if batch is not None:
+        faces = componentSet.ComponentSet.fromStrings(face)
+        batch.addFaces(faces.mesh, faces, shader)
+        return
     cmds.sets(face, e=True, forceElement=shader+"SG")
 
 
 #********************************************************
 # BUILDING FUNCTIONS                                    |
 #********************************************************
-def extrudeList(face, extrudes, heights, scales):
+def extrudeList(face, extrudes, heights, scales, commands=cmds):
     """
     Given a face and a list of extrusions, performs the extrudes in order,
     applying the given heights and scales. NOTE: The height for down is a
-    positive number.
+    positive number. Raises an InvalidExtrusionError for a bad recipe.
 
     @param face string
         The start face to extrude.
@@ -342,30 +1003,15 @@ def extrudeList(face, extrudes, heights, scales):
         keywords.
     @param scales list
         A list of scale values corresponding to 'out' and 'in' keywords.
+    @param commands module
+        The module to issue commands to, maya.cmds or a 
+        cmdBuffer.CommandBuffer.
     """
-    if len(extrudes) != len(heights) + len(scales):
-        return
-    heightIndex = 0
-    scaleIndex = 0
-    for e in extrudes:
-        if e in ["up", "down", "antenna"]:
-            h = heights[heightIndex]
-            if e == "down":
-                h = -1.0*h
-            extrude1 = cmds.polyExtrudeFacet(face, ch=1, kft=0)[0]
-            cmds.setAttr(extrude1+".localTranslateZ", h)
-            if e == "antenna":
-                cmds.setAttr(extrude1+".localScaleX", 0.5)
-                cmds.setAttr(extrude1+".localScaleY", 0.5)
-            heightIndex += 1
-        elif e in ["in", "out"]:
-            s = scales[scaleIndex]
-            extrude1 = cmds.polyExtrudeFacet(face, ch=1, kft=0)[0]
-            cmds.setAttr(extrude1+".localScaleX", s)
-            cmds.setAttr(extrude1+".localScaleY", s)
-            scaleIndex += 1
-        else:
-            print "e was not a valid extrude type"
+    try:
+        ops = extrudeRecipe.compileRecipe(extrudes, heights, scales)
+    except extrudeRecipe.RecipeError as e:
+        raise InvalidExtrusionError(str(e))
+    extrudeRecipe.applyOps(face, ops, commands)
 
 #********************************************************
 # UI FUNCTIONS                                          |
@@ -402,42 +1048,44 @@ def squaredDistanceBetween(v1, v2):
 
 def avgEdgeLength(mesh):
     """
-    Calculates the average edge length of a mesh.
+    Calculates the mean edge length of a mesh.
     """
-    avg = 0
-    n = 1
-    edges = cmds.polyListComponentConversion(mesh, te=True)
-    edges = cmds.ls(edges, fl=True)
-    for edge in edges:
-        verts = cmds.polyListComponentConversion(edge, tv=True)
-        verts = cmds.ls(verts, fl=True)
-        sample = squaredDistanceBetween(verts[0], verts[1])
-        avg = ((n-1)*avg + sample)/n
-        n += 1
-
-    return avg
+    topology = meshTopology.getTopology(mesh)
+    positions = topology.positions()
+    edgeVertices = topology.edgeVertices()
+    edgeCount = len(edgeVertices)/2
+    if not edgeCount:
+        return 0
+    total = 0.0
+    for e in xrange(edgeCount):
+        a = 3*edgeVertices[2*e]
+        b = 3*edgeVertices[2*e+1]
+        total += distBetween(positions[a:a+3], positions[b:b+3])
+    return total/edgeCount
 
 def quickTest(testType='mesh'):
     targetMesh = cmds.ls(sl=True)[0]
     if testType == 'mesh':
         testMesh(0.1, targetMesh)
     else:
-        sourcePlane = cmds.polyChipOff('%s.f[0]'%targetMesh, duplicate=True)
+        sourcePlane = duplicateFace('%s.f[0]'%targetMesh)
         testPlanes(0.1, sourcePlane, targetMesh)
 
 def testPlanes(spawnChance, plane, target):
     avLen = avgEdgeLength(target)
     cb = CityBlock('testBlockPlanes', plane, target, 'plane', minHeight=avLen,
             maxHeight=5.0*avLen)
-    initializeProgressWindow("Building Planes", len(cb.faceList))
-    cb.buildPlanes()
+    plan = cb.plan()
+    initializeProgressWindow("Building Planes", len(plan))
+    cb.buildPlanes(plan)
 
 def testMesh(spawnChance, target):
     avLen = avgEdgeLength(target)
     cb = CityBlock('testBlockMesh', None, target, 'mesh', minHeight=avLen,
             maxHeight=5.0*avLen)
-    initializeProgressWindow("Building Mesh", len(cb.faceList))
-    cb.buildMesh()
+    plan = cb.plan()
+    initializeProgressWindow("Building Mesh", len(plan))
+    cb.buildMesh(plan)
 
 """def testPlanes(dropRate,plane):
     blah = cityBlock("blah")
@@ -3,15 +3,56 @@ import sys, os, re
 
 # Qt Imports
 from PyQt4 import QtCore, QtGui, uic
-from PyQt.QtCore import pyqtSlot
+from PyQt4.QtCore import pyqtSlot
+
+# Maya Imports
+import maya.cmds as cmds
 
 # Non-standard Imports
+import cityPlan
+import cityScheduler
 import quickCity
 
 # Globals
 FILE_PATH = os.path.dirname(__file__)
+BUILD_TYPES = ['mesh', 'plane', 'geometry']   # In comboBox_extrude order.
+NAME_COLUMN = 0
 
 # Classes
+class BuildWorker(QtCore.QObject):
+    """
+    Prepares the jobs of a cityScheduler.BuildScheduler on a worker thread.
+    Every job is planned at once with BuildScheduler.planAll, in parallel
+    worker processes, then the jobs are prepared in queue order, emitting
+    prepared with the index of each job as it is ready to be built on the
+    main thread.
+    """
+    prepared = QtCore.pyqtSignal(int)
+    failed = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, scheduler):
+        super(BuildWorker, self).__init__()
+        self.scheduler = scheduler
+
+    @pyqtSlot()
+    def run(self):
+        """
+        Plans every job, then prepares each job until done or cancelled.
+        """
+        try:
+            self.scheduler.planAll()
+            for index, job in enumerate(self.scheduler.jobs):
+                if self.scheduler.cancelled:
+                    break
+                self.scheduler.prepareJob(job)
+                self.prepared.emit(index)
+        except Exception as e:
+            self.scheduler.cancel()
+            self.failed.emit(str(e))
+        self.finished.emit()
+
+
 class QuickCityWindow(object):
     """
     The main window.
@@ -20,6 +61,17 @@ class QuickCityWindow(object):
         super(QuickCityWindow, self).__init__()
         self.ui = uic.loadUi(os.path.join(FILE_PATH, 'quickCity.ui'))
 
+        # The settings of each block in treeWidget_blocks, by block name.
+        self.blocks = {}
+        # The CityBlocks previewing blocks while their settings are edited.
+        self.previews = {}
+        # The CityBlocks that have been built, which remember what they
+        # built so that they can be rebuilt incrementally.
+        self.builtBlocks = {}
+        self.scheduler = None
+        self.thread = None
+        self.worker = None
+
         # Connect UI to controller functions.
         self.connectSignalsToSlots()
 
@@ -27,7 +79,15 @@ class QuickCityWindow(object):
         """
         Connects UI elements to their slot functions.
         """
-        pass
+        self.ui.pushButton_addBlock.clicked.connect(self.addBlockClicked)
+        self.ui.pushButton_removeBlock.clicked.connect(
+                self.removeBlockClicked)
+        self.ui.pushButton_buildAll.clicked.connect(self.buildAllClicked)
+        self.ui.pushButton_updateBlock.clicked.connect(
+                self.updateBlockClicked)
+        for spinBox in [self.ui.spinBox_minH, self.ui.spinBox_maxH,
+                self.ui.spinBox_minL, self.ui.spinBox_maxL]:
+            spinBox.valueChanged.connect(self.settingsChanged)
 
     @pyqtSlot()
     def submitClicked(self):
@@ -36,6 +96,235 @@ class QuickCityWindow(object):
         """
         pass
 
+    @pyqtSlot()
+    def addBlockClicked(self):
+        """
+        Adds a block for the selected mesh, or the mesh of the selected face,
+        with the current height and level values. A selected face is used
+        as the center of the block. Plane blocks get a copy of the mesh's
+        first face as their source plane. No block is added while the
+        values are invalid.
+        """
+        selection = cmds.ls(sl=True)
+        values = self.checkedValues()
+        if not selection or values is None:
+            return
+        faces = quickCity.getSelectedFaces()
+        if faces.mesh:
+            targetMesh = faces.mesh
+            centerFace = '%s.f[%d]' % (targetMesh, faces.starts[0])
+        else:
+            targetMesh = selection[0].split('.')[0]
+            centerFace = targetMesh + '.f[0]'
+
+        i = 1
+        while 'block%d' % i in self.blocks:
+            i += 1
+        name = 'block%d' % i
+        buildType = BUILD_TYPES[self.ui.comboBox_extrude.currentIndex()]
+        settings = {'targetMesh':targetMesh, 'centerFace':centerFace,
+                'minHeight':values[0], 'maxHeight':values[1],
+                'minLevels':values[2], 'maxLevels':values[3],
+                'buildType':buildType,
+                'edgeLength':quickCity.avgEdgeLength(targetMesh),
+                'sourcePlane':None}
+        if buildType == 'plane':
+            settings['sourcePlane'] = quickCity.duplicateFace(
+                    '%s.f[0]' % targetMesh, name + '_sourcePlane')
+        self.blocks[name] = settings
+        item = QtGui.QTreeWidgetItem([name, str(settings['minHeight']),
+            str(settings['maxHeight']), str(settings['minLevels']),
+            str(settings['maxLevels'])])
+        item.setToolTip(NAME_COLUMN, targetMesh)
+        self.ui.treeWidget_blocks.addTopLevelItem(item)
+
+    @pyqtSlot()
+    def removeBlockClicked(self):
+        """
+        Removes the selected blocks, deleting their source planes.
+        """
+        tree = self.ui.treeWidget_blocks
+        for item in tree.selectedItems():
+            name = str(item.text(NAME_COLUMN))
+            settings = self.blocks.pop(name, {})
+            sourcePlane = settings.get('sourcePlane')
+            if sourcePlane and cmds.objExists(sourcePlane):
+                cmds.delete(sourcePlane)
+            self.builtBlocks.pop(name, None)
+            self.clearPreview(name)
+            tree.takeTopLevelItem(tree.indexOfTopLevelItem(item))
+
+    def checkedValues(self):
+        """
+        Returns the current [minHeight, maxHeight, minLevels, maxLevels] 
+        values, or None after warning if they can't be planned with.
+        """
+        values = [self.ui.spinBox_minH.value(), self.ui.spinBox_maxH.value(),
+                self.ui.spinBox_minL.value(), self.ui.spinBox_maxL.value()]
+        try:
+            cityPlan.checkParameters(*values)
+        except cityPlan.CityPlanError as e:
+            cmds.warning("quickCity: %s" % e)
+            return None
+        return values
+
+    @pyqtSlot(int)
+    def settingsChanged(self, value):
+        """
+        Previews the selected blocks with the current height and level
+        values, as boxes that are updated in place as the values change.
+        Nothing is built until the values are committed, and nothing is
+        previewed while the values are invalid.
+        """
+        values = self.checkedValues()
+        if values is None:
+            return
+        tree = self.ui.treeWidget_blocks
+        for item in tree.selectedItems():
+            name = str(item.text(NAME_COLUMN))
+            settings = self.blocks[name]
+            block = self.previews.get(name)
+            if block is None:
+                block = quickCity.CityBlock(name, None, 
+                        settings['targetMesh'], 'mesh',
+                        centerFaces=[settings['centerFace']])
+                self.previews[name] = block
+            edgeLength = settings['edgeLength']
+            block.setParameters(values[0]*edgeLength, values[1]*edgeLength,
+                    values[2], values[3])
+            block.preview()
+
+    @pyqtSlot()
+    def updateBlockClicked(self):
+        """
+        Commits the current height and level values to the selected blocks
+        and removes their previews. Blocks that have been built are rebuilt,
+        regenerating only the buildings the new values change.
+        """
+        values = self.checkedValues()
+        if values is None:
+            return
+        tree = self.ui.treeWidget_blocks
+        for item in tree.selectedItems():
+            name = str(item.text(NAME_COLUMN))
+            self.blocks[name].update(zip(['minHeight', 'maxHeight', 
+                'minLevels', 'maxLevels'], values))
+            for column, value in enumerate(values):
+                item.setText(column+1, str(value))
+            self.clearPreview(name)
+            block = self.builtBlocks.get(name)
+            if block is None:
+                continue
+            edgeLength = self.blocks[name]['edgeLength']
+            block.setParameters(values[0]*edgeLength, values[1]*edgeLength,
+                    values[2], values[3])
+            try:
+                block.rebuild()
+            except quickCity.QuickCityError as e:
+                cmds.warning(str(e))
+
+    def clearPreview(self, name):
+        """
+        Deletes the preview of the named block, if it has one.
+        """
+        block = self.previews.pop(name, None)
+        if block is not None:
+            block.clearPreview()
+
+    @pyqtSlot()
+    def buildAllClicked(self):
+        """
+        Builds every block in the list that has not been built yet with a
+        cityScheduler.BuildScheduler; built blocks are brought up to date
+        with Update instead.
+        The blocks read the scene here, then parallel planning and geometry
+        generation run on a BuildWorker thread while the window stays 
+        responsive, and each block is built on this thread as soon as it
+        is prepared. While building, the build button cancels the blocks 
+        not yet built.
+        """
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+            return
+
+        for name in list(self.previews):
+            self.clearPreview(name)
+        tree = self.ui.treeWidget_blocks
+        scheduler = cityScheduler.BuildScheduler()
+        for i in range(tree.topLevelItemCount()):
+            name = str(tree.topLevelItem(i).text(NAME_COLUMN))
+            if name not in self.builtBlocks:
+                scheduler.add(self.makeBlock(name, self.blocks[name]))
+        if not scheduler.jobs:
+            return
+        self.scheduler = scheduler
+        self.ui.pushButton_buildAll.setText('Cancel')
+
+        # Signals from the worker are queued onto this thread's event loop.
+        self.thread = QtCore.QThread()
+        self.worker = BuildWorker(scheduler)
+        self.worker.moveToThread(self.thread)
+        self.thread.started.connect(self.worker.run)
+        self.worker.prepared.connect(self.jobPrepared)
+        self.worker.failed.connect(self.buildFailed)
+        self.worker.finished.connect(self.thread.quit)
+        self.thread.finished.connect(self.buildFinished)
+        self.thread.start()
+
+    def jobPrepared(self, index):
+        """
+        Builds a job the worker has prepared, unless the build has been
+        cancelled, and marks its block as built.
+        """
+        if self.scheduler is None or self.scheduler.cancelled:
+            return
+        job = self.scheduler.jobs[index]
+        self.scheduler.buildJob(job)
+        self.builtBlocks[job.name] = job.block
+        tree = self.ui.treeWidget_blocks
+        items = tree.findItems(job.name, QtCore.Qt.MatchExactly, NAME_COLUMN)
+        for item in items:
+            item.setToolTip(NAME_COLUMN, '%s: built in %.2fs' % (job.name,
+                sum(job.timings.values())))
+
+    def buildFailed(self, message):
+        """
+        Reports an error raised on the worker thread.
+        """
+        cmds.warning("quickCity build failed: %s" % message)
+
+    def buildFinished(self):
+        """
+        Waits for the worker thread to stop, reports each job's status and
+        timings in the tooltip of its block and resets the build button.
+        """
+        self.thread.wait()
+        lines = self.scheduler.finish().split('\n')
+        tree = self.ui.treeWidget_blocks
+        for job, line in zip(self.scheduler.jobs, lines):
+            for item in tree.findItems(job.name, QtCore.Qt.MatchExactly,
+                    NAME_COLUMN):
+                item.setToolTip(NAME_COLUMN, line)
+        self.scheduler = None
+        self.worker = None
+        self.thread = None
+        self.ui.pushButton_buildAll.setText('Build')
+
+    def makeBlock(self, name, settings):
+        """
+        Returns a quickCity.CityBlock for the given block settings. Heights
+        are in multiples of the target mesh's mean edge length.
+        """
+        targetMesh = settings['targetMesh']
+        edgeLength = settings['edgeLength']
+        return quickCity.CityBlock(name, settings['sourcePlane'], targetMesh,
+                settings['buildType'],
+                minHeight=settings['minHeight']*edgeLength,
+                maxHeight=settings['maxHeight']*edgeLength,
+                minLevels=settings['minLevels'],
+                maxLevels=settings['maxLevels'],
+                centerFaces=[settings['centerFace']])
+
 
 # Functions
 WINDOW = None
@@ -49,5 +338,3 @@ def runMaya():
     if not WINDOW:
         WINDOW = QuickCityWindow()
     WINDOW.ui.show()
-
-
@@ -4,6 +4,7 @@ level, the script will create a voxelized version of the mesh.
 """
 
 # Imports
+import meshTopology
 import satTest
 import maya.cmds as cmds
 
@@ -40,21 +41,19 @@ def voxelize(mesh_name, division_level):
     #@TODO: probably best to implment this without modifying the original mesh,
     # but then we need to implement our own polygon --> triangle subdivison.
     cmds.polyTriangulate(mesh_name, ch=1)
+    meshTopology.invalidate(mesh_name)
+    topology = meshTopology.getTopology(mesh_name)
     
     # Loop over each face in the mesh, and find which boxes it intersects.
     vox_map = {}
-    faces = cmds.ls('%s.f[*]'%mesh_name, fl=True)
+    face_count = topology.faceCount
     
     i = 0
-    initializeProgressWindow("Voxelizing Mesh", len(faces))
-    for face in faces:
-        if not updateProgressWindow(i, len(faces)):
+    initializeProgressWindow("Voxelizing Mesh", face_count)
+    for face_index in xrange(face_count):
+        if not updateProgressWindow(i, face_count):
             break
-        verts = cmds.ls(cmds.polyListComponentConversion(face, tv=True), fl=True)
-        v0 = cmds.xform(verts[0], t=True, q=True)
-        v1 = cmds.xform(verts[1], t=True, q=True)
-        v2 = cmds.xform(verts[2], t=True, q=True)
-        tri_verts = v0+v1+v2
+        tri_verts = topology.facePositions(face_index)
         tri = satTest.Triangle(*tri_verts)
         for voxel in voxel_lattice:
             try:
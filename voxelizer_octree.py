@@ -1,7 +1,7 @@
-# Standard Imports
-import re
-
 # Non-standard Imports
+import cmdBuffer
+import componentSet
+import meshTopology
 import octTree
 
 # Maya Imports
@@ -16,7 +16,7 @@ This is a script for generating a voxel representation of a mesh.
 """
 
 # Globals
-VERT_SPLIT_RE = re.compile(".*\[(\d*):(\d*)\]")
+DIVISION_LEVEL = 5
 
 
 def _flatten_vert_list(mesh_name, vert_list):
@@ -24,16 +24,11 @@ def _flatten_vert_list(mesh_name, vert_list):
     Given a list containing vertices which may appear as ranges, return a list
     containing only exact vertices. (e.g converts [pPlane1.vtx[0:2]] to 
     [pPlane1.vtx[0], pPlane1.vtx[1] pPlane1.vtx[2]]
-    NOTE: The ranges maya returns are inclusive on both ends.
+    NOTE: The ranges maya returns are inclusive on both ends. Prefer keeping
+    a componentSet.ComponentSet where single components aren't needed.
     """
-    flattened_verts = []
-    for vert_item in vert_list:
-        match = VERT_SPLIT_RE.match(vert_item)
-        if not match:
-            continue
-        for vert_index in match.groups():
-            flattened_verts.append('%s.vtx[%d]'%(mesh_name, vert_index))
-    return flattened_verts
+    vert_set = componentSet.ComponentSet.fromStrings(vert_list)
+    return ['%s.vtx[%d]'%(mesh_name, vert_index) for vert_index in vert_set]
 
 # Functions.
 def _voxelize_mesh(mesh_name, num_divisions):
@@ -55,36 +50,67 @@ def _voxelize_mesh(mesh_name, num_divisions):
         tree_node = oct_tree_nodes.pop(0)
         if tree_node.division_level < num_divisions:
             tree_node.subdivide()
-            oct_tree_nodes.append(tree_node.children())
-        break
+            oct_tree_nodes.extend(tree_node.children)
+
+    # The mesh may have been edited since the cache was filled.
+    meshTopology.invalidate(mesh_name)
+    topology = meshTopology.getTopology(mesh_name)
+    positions = topology.positions(worldSpace=True)
 
     voxel_locations = set()
     # For each face in the mesh, find the node(s) containing that face.
-    for face_index in xrange(cmds.polyEvaluate(mesh_name, f=True)):
-        verts = cmds.polyListComponentConversion('%s.f[%d]'%(mesh_name, 
-            face_index), ff=True, tv=True)
-
-        #Flatten the vertex list
-        vert_list = _flatten_vert_list(mesh_name, verts)
-
-        # Find the leaf node containing this vert.
-        for vert in vert_list:
-            node = oct_tree.root
-            while node.children:
-                node = node.child_containing(vert)
+    for face_index in xrange(topology.faceCount):
+        # Find the leaf node containing each vert.
+        for vert_index in topology.faceVertexIndices(face_index):
+            vert = positions[3*vert_index:3*vert_index+3]
+            node = oct_tree.leaf_containing(vert)
 
             # Add the midpoint of the leaf node to the voxel set
             voxel_locations.add(node.half_values)
 
     # Create a cube at each of the voxel_locations
-    for i, (lx, ly, lz) in enumerate(voxel_locations):
-        cname = '%s_vox_%d'%(mesh_name, i)
-        cmds.polyCube(name=cname)
-        cmds.xform(cname, translation=[lx,ly,lz])
+    _create_voxels(mesh_name, voxel_locations)
+
+def _quantize_mesh_vertices(mesh_name, num_divisions):
+    """
+    Returns the centers of the leaves holding the vertices of the mesh, for an
+    octTree over the mesh bounds subdivided num_divisions times. The vertex
+    positions come from the topology cache and are quantized straight to leaf
+    indices, so no tree nodes are created. This is a quick preview of
+    the surface voxelizers, which also fill voxels crossed by faces.
+    mesh_name: the name of the mesh
+    num_divisions: the number of times to subdivide the octTree.
+    """
+    min_x, min_y, min_z, max_x, max_y, max_z =\
+            cmds.exactWorldBoundingBox(mesh_name)
+    oct_tree = octTree.OctTree((min_x,min_y,min_z), (max_x,max_y,max_z))
+
+    # The mesh may have been edited since the cache was filled.
+    meshTopology.invalidate(mesh_name)
+    topology = meshTopology.getTopology(mesh_name)
+    positions = topology.positions(worldSpace=True)
+    points = zip(positions[0::3], positions[1::3], positions[2::3])
+    leaf_indices = oct_tree.leaf_indices(points, num_divisions)
+    return [oct_tree.leaf_center(index, num_divisions) for index in 
+            sorted(leaf_indices)]
+
+def _create_voxels(mesh_name, voxel_locations):
+    """
+    Creates a cube at each of the voxel_locations. The commands are buffered
+    and run together in one undo chunk.
+    """
+    with cmdBuffer.CommandBuffer() as command_buffer:
+        for i, (lx, ly, lz) in enumerate(voxel_locations):
+            cname = '%s_vox_%d'%(mesh_name, i)
+            command_buffer.polyCube(name=cname)
+            command_buffer.xform(cname, translation=[lx,ly,lz])
 
-def runMaya():
+def runMaya(num_divisions=DIVISION_LEVEL, preview=False):
     """
     Voxelizes the currently selected mesh(es).
+    num_divisions: the number of times to subdivide the octTree.
+    preview: if True, only the voxels holding mesh vertices are created,
+        using the fast quantized path.
     """
     if not MAYA_MODE:
         print "Tool must be run within Maya."
@@ -102,4 +128,7 @@ def runMaya():
             continue
 
         # Voxelize!
-        _voxelize_mesh(obj)
+        if preview:
+            _create_voxels(obj, _quantize_mesh_vertices(obj, num_divisions))
+        else:
+            _voxelize_mesh(obj, num_divisions)